@@ -0,0 +1,76 @@
+import time
+from typing import Dict, Optional, Tuple
+
+from src.repositories.persona_repo import get_default_persona, get_persona_pid
+
+# 画像文本进程内缓存：{(user_id, persona_id): (过期时间戳, 画像文本)}
+# 画像极少变动，而每次聊天请求都会新建 HostAgent 并读取画像，缓存可省去 1~2 次数据库往返。
+_TTL_SECONDS: float = 60.0
+_MAX_ENTRIES: int = 1024
+
+_cache: Dict[Tuple[Optional[str], Optional[str]], Tuple[float, Optional[str]]] = {}
+# 每个 user_id / persona_id 的失效代数：加载期间若发生失效，加载结果不再写入缓存，避免旧画像回填
+_generations: Dict[str, int] = {}
+
+
+def _generation(user_id: Optional[str], persona_id: Optional[str]) -> Tuple[int, int]:
+    """缓存键对应的失效代数"""
+    return _generations.get(user_id, 0) if user_id else 0, _generations.get(persona_id, 0) if persona_id else 0
+
+
+async def _load_persona_text(user_id: Optional[str], persona_id: Optional[str]) -> Optional[str]:
+    """
+    从数据库加载并编译画像文本：
+    - 仅提供 user_id 时，取该用户的默认画像
+    - 提供 persona_id 时，直接按ID读取
+    均未获取到则返回 None。
+    """
+    if user_id and not persona_id:
+        default_persona = await get_default_persona(user_id)
+        if default_persona:
+            return default_persona.compile_profile_prompt()
+
+    if persona_id:
+        user_persona = await get_persona_pid(persona_id)
+        if user_persona:
+            return user_persona.compile_profile_prompt()
+
+    return None
+
+
+async def get_persona_text_cached(user_id: Optional[str], persona_id: Optional[str]) -> Optional[str]:
+    """
+    获取编译后的画像文本（带TTL缓存）。
+    未命中时查询数据库；“未找到画像”的结果（None）同样会被缓存。
+    """
+    key = (user_id, persona_id)
+    now = time.monotonic()
+    entry = _cache.get(key)
+    if entry and entry[0] > now:
+        return entry[1]
+
+    generation = _generation(user_id, persona_id)
+    text = await _load_persona_text(user_id, persona_id)
+
+    # 读取代数与写入缓存之间没有 await，单事件循环内无需加锁
+    if _generation(user_id, persona_id) == generation:
+        if len(_cache) >= _MAX_ENTRIES:
+            # 先清理过期项；仍然过多则整体清空，保证内存有界
+            for k in [k for k, (expiry, _) in _cache.items() if expiry <= now]:
+                del _cache[k]
+            if len(_cache) >= _MAX_ENTRIES:
+                _cache.clear()
+        _cache[key] = (time.monotonic() + _TTL_SECONDS, text)
+    return text
+
+
+def invalidate(user_id: Optional[str] = None, persona_id: Optional[str] = None) -> None:
+    """
+    画像被创建/更新后使相关缓存失效。
+    匹配 user_id 或 persona_id 任意一项的缓存条目都会被移除，进行中的加载结果也不会再写入缓存。
+    """
+    for target in (user_id, persona_id):
+        if target:
+            _generations[target] = _generations.get(target, 0) + 1
+    for key in [k for k in _cache if (user_id and k[0] == user_id) or (persona_id and k[1] == persona_id)]:
+        _cache.pop(key, None)
@@ -1,14 +1,32 @@
-from typing import Any, Optional, Dict, List, AsyncGenerator, Union
+import asyncio
+from typing import Any, Optional, Dict, List, Set, AsyncGenerator, Union
 
 from agentscope.model import DashScopeChatModel, ChatResponse
-from tenacity import retry, stop_after_attempt, wait_fixed
 
 from src.config.settings import settings
 from src.utils.logger import logger
 
-from src.repositories.chat_repo import get_or_create_session, add_message, get_last_messages
-from src.repositories.persona_repo import get_persona, get_persona_pid
-from src.db.models import Persona
+from src.repositories.chat_repo import get_or_create_session, add_messages, get_last_messages
+from src.agents._persona_cache import get_persona_text_cached
+
+# 各会话尚未完成的后台持久化任务：{session_id: Task}
+# 下一轮读取历史前需等待上一轮写入完成，保证“记忆”不缺失最近一轮对话。
+_inflight_persist: Dict[str, asyncio.Task] = {}
+
+def create_chat_model(stream: bool = False) -> DashScopeChatModel:
+    """
+    构建 DashScope 对话模型。
+    应用启动时创建一个共享实例供所有请求复用（见 src.api.app），避免每次请求重复初始化模型客户端。
+    """
+    return DashScopeChatModel(
+        model_name=settings.MODEL_NAME,
+        api_key=settings.API_KEY,
+        stream=stream,
+        generate_kwargs={
+            "result_format": "message",
+            "text_type": "text"
+        }
+    )
 
 class HostAgent:
     """
@@ -32,34 +50,37 @@ class HostAgent:
             persona: Optional[str] = None,
             # 若提供 persona_id，将自动从DB读取画像文本
             persona_id: Optional[str] = None,
+            # 若提供后台任务集合，则本轮消息的持久化在后台执行，不阻塞响应结束
+            bg_tasks: Optional[Set[asyncio.Task]] = None,
     ) -> None:
 
         self.agent_name = agent_name
         self.model_name = settings.MODEL_NAME
         self.stream = stream
-        self.model = model or DashScopeChatModel(
-            model_name=self.model_name,
-            api_key=settings.API_KEY,
-            stream=self.stream,
-            generate_kwargs={
-                "result_format": "message",
-                "text_type": "text"
-            }
-
-        )
+        # 优先复用外部传入的共享模型；未提供时才单独构建
+        self.model = model or create_chat_model(stream=self.stream)
         self.user_id = user_id
         self.session_id = session_id
         self.persona_id = persona_id
         self.persona = persona or ""
+        self._bg_tasks = bg_tasks
 
         # 内部状态
         self._chat_session_pk: Optional[str] = None  # chat_sessions 主键缓存
         self._persona_loaded: bool = False
+        self._has_history: bool = True  # 会话为本次新建时置 False，跳过历史查询
 
         # 历史与消息长度限制
         self._history_limit: int = 100       # 取最近多少条历史消息作为“记忆”
         self._msg_words_limit: int = 10000  # “画像/记忆”注入的最大字符数
 
+        # 非流式调用的重试策略（流式调用不重试，异常直接交给上层处理）
+        self._max_attempts: int = 3
+        self._retry_wait: float = 2.0
+
+        # 系统提示词只依赖 agent_name，构建一次后复用
+        self._system_prompt_cached: str = self._system_prompt()
+
     def _system_prompt(self) -> str:
         return f"""
         你是 {self.agent_name}，负责协调其他Agent，并输出最终结果。用户问一般问题，你可直接简明答复。
@@ -73,25 +94,32 @@ class HostAgent:
         - assistant(name=memory)：最近历史（如存在）
         - user：本次用户输入
         注意：“记忆”不包含本次用户输入（先构建再写入DB）。
+        画像加载与历史读取（含会话确保）互不依赖，并发执行以减少等待。
         """
-        msgs: List[Dict[str, Any]] = [{"role": "system", "content": self._system_prompt()}]
+        _, memory_text = await asyncio.gather(
+            self._ensure_persona_text(),
+            self._load_memory_text(),
+        )
+        msgs: List[Dict[str, Any]] = [{"role": "system", "content": self._system_prompt_cached}]
 
         # 画像（优先使用 persona_id 从DB加载后的 self.persona；否则使用现有 self.persona）
         if self.persona:
-            persona_text = self.persona[-self._msg_words_limit:]
+            # 未超长时直接复用原字符串，避免无谓的切片拷贝
+            persona_text = self.persona
+            if len(persona_text) > self._msg_words_limit:
+                persona_text = persona_text[-self._msg_words_limit:]
             msgs.append({
                 "role": "assistant",
                 "name": "persona",
                 "content": f"用户[画像]：\n{persona_text}"
             })
 
-        # 历史（从DB读取最近 N 条）
-        memory_text = await self._load_memory_text()
+        # 历史（从DB读取最近 N 条，_load_memory_text 已按字数上限截取）
         if memory_text:
             msgs.append({
                 "role": "assistant",
                 "name": "memory",
-                "content": f"历史对话[记忆]：\n{memory_text[-self._msg_words_limit:]}"
+                "content": f"历史对话[记忆]：\n{memory_text}"
             })
 
         # 本次用户输入（不持久化到“记忆”中）
@@ -119,21 +147,11 @@ class HostAgent:
         if self.persona:
             return
         try:
-            # 如果提供了 user_id，尝试获取默认 persona
-            if self.user_id and not self.persona_id:
-                personas = await get_persona(self.user_id)
-                if personas:  # 确保列表不为空
-                    default_persona = next((p for p in personas if p.is_default), None)
-                    if default_persona:
-                        self.persona = default_persona.compile_profile_prompt()
-                        return
-                
-            # 如果有具体的 persona_id，则直接获取
-            if self.persona_id:
-                user_persona = await get_persona_pid(self.persona_id)
-                if user_persona:
-                    self.persona = user_persona.compile_profile_prompt()
-                    return
+            # 画像文本经进程内TTL缓存获取（默认画像或指定 persona_id）
+            persona_text = await get_persona_text_cached(self.user_id, self.persona_id)
+            if persona_text:
+                self.persona = persona_text
+                return
 
             # 如果都没有获取到，使用默认配置
             self.persona = "We haven't pulled up your user profile yet. Mind giving a gentle nudge to sign in and fill out your details? The login button is tucked in the top-left corner. 😊"
@@ -152,77 +170,132 @@ class HostAgent:
         if self._chat_session_pk:
             return self._chat_session_pk
         
-        sess = await get_or_create_session(
+        sess, created = await get_or_create_session(
             session_key=self.session_id,
             user_id=self.user_id,
             # persona_id=self.persona_id,
         )
-        self._db_session_pk = sess.id
-        return self._db_session_pk
+        self._chat_session_pk = sess.id
+        if created:
+            self._has_history = False
+        return self._chat_session_pk
 
     async def _load_memory_text(self) -> str:
         """
         从数据库读取最近历史消息并拼接为可读文本：
         格式： [role] content\n...
-        若无 session_id 或查询失败则返回空字符串。
+        若无 session_id、历史条数上限为 0 或会话为新建（无历史）则返回空字符串。
+        拼接前先按 _msg_words_limit 从末尾截取，避免生成超长字符串后再切片。
         """
+        if self._history_limit <= 0:
+            return ""
         session_pk = await self._ensure_session_pk()
-        if not session_pk: 
+        if not session_pk or not self._has_history:
             return ""
+        pending = _inflight_persist.get(self.session_id)
+        if pending:
+            await asyncio.wait({pending})
         history = await get_last_messages(session_pk=session_pk, limit=self._history_limit)
-        parts: List[str] = []
-        for m in history:
-            role = getattr(m, "role", "")
-            content = getattr(m, "content", "")
-            parts.append(f"[{role}] {content}")
-        return "\n".join(parts)
+        parts: List[str] = [f"[{m.role}] {m.content}" for m in history]
 
-    async def _persist_message(
+        # 从最新消息向前累计字符数（含换行符），超出预算的那条只保留其末尾部分
+        budget = self._msg_words_limit
+        kept: List[str] = []
+        for part in reversed(parts):
+            if len(part) >= budget:
+                kept.append(part[-budget:])
+                break
+            kept.append(part)
+            budget -= len(part) + 1
+            if budget <= 0:
+                break
+        kept.reverse()
+        return "\n".join(kept)
+
+    def _message_row(
             self,
             role: str,
             content: str,
-            usage:Dict[str, Any] = None
-    ) -> None:
+            usage: Dict[str, Any] = None
+    ) -> Dict[str, Any]:
+        """构建一条待写入数据库的消息字段字典。"""
+        # 创建元数据
+        meta = {
+            "agent_name": self.agent_name,
+            "model_name": self.model_name
+        }
+        return {
+            "role": role,
+            "content": content,
+            "name": None,
+            "input_tokens": usage.get("input_tokens", None) if usage else None,
+            "output_tokens": usage.get("output_tokens", None) if usage else None,
+            "response_time": usage.get("time", None) if usage else None,
+            "meta": meta,
+        }
+
+    async def _persist_messages(self, rows: List[Dict[str, Any]]) -> None:
         """
-        将消息写入数据库（若提供了 session_id）。
-        失败时仅记录日志，不中断主流程。
+        将一轮对话的消息在同一事务中批量写入数据库（若提供了 session_id）。
+        内容为空的消息会被跳过。
         """
-        if not self.session_id or not content:
+        rows = [row for row in rows if row["content"]]
+        if not self.session_id or not rows:
             return
         session_pk = await self._ensure_session_pk()
         if not session_pk:
             return
-        # 创建元数据
-        meta = {
-            "agent_anme": self.agent_name,
-            "model_name": self.model_name
-        }
-        await add_message(
-            session_pk=session_pk,
-            role=role,
-            content=content,
-            name=None,
-            input_tokens=usage.get("input_tokens", None) if usage else None,
-            output_tokens=usage.get("output_tokens", None) if usage else None,
-            response_time=usage.get("time", None) if usage else None,
-            meta=meta,
-        )
+        await add_messages(session_pk=session_pk, rows=rows)
+        self._has_history = True
+
+    async def _persist_in_background(self, rows: List[Dict[str, Any]]) -> None:
+        """后台持久化任务体：异常只记录日志，不向外抛出。"""
+        try:
+            await self._persist_messages(rows)
+        except Exception as e:
+            logger.error(f"会话id: {self.session_id} 消息持久化失败! 错误信息: {str(e)}", exc_info=True)
+        finally:
+            if _inflight_persist.get(self.session_id) is asyncio.current_task():
+                _inflight_persist.pop(self.session_id, None)
+
+    async def _persist_turn(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        持久化一轮对话：
+        - 提供了 bg_tasks 时创建后台任务并登记，立即返回（应用关闭时统一等待）
+        - 否则直接等待写入完成
+        """
+        if self._bg_tasks is None or not self.session_id:
+            await self._persist_messages(rows)
+            return
+        task = asyncio.create_task(self._persist_in_background(rows))
+        _inflight_persist[self.session_id] = task
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._bg_tasks.discard)
+
+    async def _call_model_with_retry(self, messages: List[Dict[str, Any]]) -> ChatResponse:
+        """非流式调用模型，失败时按固定间隔重试（仅重试模型调用本身，不重复持久化）。"""
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                return await self.model(messages)
+            except Exception as e:
+                if attempt == self._max_attempts:
+                    raise
+                logger.warning("模型调用失败，第%s次重试: %s", attempt, e)
+                await asyncio.sleep(self._retry_wait)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
     async def reply(self, instructions: str) -> ChatResponse:
         try:
-            # 自动加载 persona（若传入 persona_id）
-            await self._ensure_persona_text()
-            # 构建上下文
+            # 构建上下文（自动加载 persona 与历史）
             messages: List[Dict[str, Any]] = await self._build_messages(instructions)
-            # 写入用户消息（持久化）
-            await self._persist_message("user", instructions)
-
-            response = await self.model(messages)
-            if response:
-                content = self._res_to_text(response)
-                # 写入助手消息（持久化）
-                await self._persist_message("assistant", content)
+            # 本轮消息先缓存，模型返回后与助手消息一次性写入
+            pending: List[Dict[str, Any]] = [self._message_row("user", instructions)]
+            try:
+                response = await self._call_model_with_retry(messages)
+                if response:
+                    pending.append(self._message_row("assistant", self._res_to_text(response)))
+            finally:
+                # 即使模型调用失败，也保留用户消息
+                await self._persist_turn(pending)
             return response
         except Exception as e:
             logger.error(
@@ -231,29 +304,27 @@ class HostAgent:
             )
             raise
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
     async def stream_reply(self, instructions: str) -> AsyncGenerator[Union[str, Dict[str, Any]], None]:
         try:
-            # 自动加载 persona（若传入 persona_id）
-            await self._ensure_persona_text()
-            # 构建上下文
+            # 构建上下文（自动加载 persona 与历史）
             messages: List[Dict[str, Any]] = await self._build_messages(instructions)
-            # 写入用户消息（持久化）
-            await self._persist_message("user", instructions)
-
-            generator = await self.model(messages)
-            last_chunk = None  # 用于存储最后一次迭代的完整对象
-            async for chunk in generator:
-                last_chunk = chunk
-                yield chunk
-            if last_chunk:
-                content = self._res_to_text(last_chunk)
-                # 写入助手消息（持久化）
-                await self._persist_message(
-                    role = "assistant",
-                    content = content,
-                    usage = last_chunk.usage if last_chunk.usage else None,
-                )
+            # 本轮消息先缓存，流式结束后与助手消息一次性写入
+            pending: List[Dict[str, Any]] = [self._message_row("user", instructions)]
+            try:
+                generator = await self.model(messages)
+                last_chunk = None  # 用于存储最后一次迭代的完整对象
+                async for chunk in generator:
+                    last_chunk = chunk
+                    yield chunk
+                if last_chunk:
+                    pending.append(self._message_row(
+                        role = "assistant",
+                        content = self._res_to_text(last_chunk),
+                        usage = last_chunk.usage if last_chunk.usage else None,
+                    ))
+            finally:
+                # 即使流式中断，也保留用户消息
+                await self._persist_turn(pending)
         except Exception as e:
             logger.error(
                 f"会话id: {self.session_id}\n\n 智能体：{self.agent_name}\n\n 原因：{str(e)}",
@@ -1,13 +1,37 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
 from src.api.routers import chat, user, session, file
+from src.agents.host_agent import create_chat_model
 from src.db.db import db_manager
+from src.utils.file_utils import ensure_upload_directories
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 初始化数据库
+    await db_manager.initialize()  # 使用全局实例
+    # 确保上传根目录存在（仅启动时一次，用户子目录在保存文件时按需创建）
+    ensure_upload_directories()
+    # 创建共享的流式对话模型，所有请求复用
+    app.state.chat_model = create_chat_model(stream=True)
+    # 后台任务集合（如对话消息持久化），持有强引用防止任务被回收
+    app.state.bg_tasks = set()
+    try:
+        yield
+    finally:
+        # 等待尚未完成的后台任务（消息持久化等）
+        if app.state.bg_tasks:
+            await asyncio.gather(*app.state.bg_tasks, return_exceptions=True)
+        # 关闭数据库连接
+        await db_manager.close()
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Agentic Tutor API", version="0.1.0")
+    app = FastAPI(title="Agentic Tutor API", version="0.1.0", lifespan=lifespan)
 
     app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -15,16 +39,6 @@ def create_app() -> FastAPI:
     async def read_root():
         return FileResponse("static/pages/chat.html")
 
-    @app.on_event("startup")
-    async def startup_event():
-        # 初始化数据库
-        await db_manager.initialize()  # 使用全局实例
-
-    @app.on_event("shutdown")
-    async def shutdown_event():
-        # 关闭数据库连接
-        await db_manager.close()
-
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
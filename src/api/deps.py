@@ -1,19 +1,45 @@
-from typing import AsyncGenerator, Optional
+import asyncio
+from typing import AsyncGenerator, Optional, Set
 from contextlib import asynccontextmanager
+
+from fastapi import Request
+from agentscope.model import DashScopeChatModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from src.agents.host_agent import HostAgent
+from src.db.db import db_manager
+
+def get_chat_model(request: Request) -> DashScopeChatModel:
+    """获取应用启动时创建的共享对话模型"""
+    return request.app.state.chat_model
+
+async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    请求级数据库会话：同一请求内的多个仓储调用共用一个连接。
+    路由内用 `async with session.begin():` 包裹多步读写，结束时统一提交一次。
+    """
+    async with db_manager.session as session:
+        yield session
+
+def get_bg_tasks(request: Request) -> Set[asyncio.Task]:
+    """获取应用级后台任务集合（关闭时统一等待完成）"""
+    return request.app.state.bg_tasks
 
 @asynccontextmanager
 async def get_agent(
     session_id: str, 
     user_id: Optional[str] = None,
+    model: Optional[DashScopeChatModel] = None,
+    bg_tasks: Optional[Set[asyncio.Task]] = None,
 ) -> AsyncGenerator[HostAgent, None]:
     agent = HostAgent(
+        model=model,
         stream=True, 
         session_id=session_id, 
         user_id=user_id,
-        
+        bg_tasks=bg_tasks,
     )
-    # 每次请求新建一个带持久化 session 的 HostAgent
+    # 每次请求新建一个带持久化 session 的 HostAgent（模型实例共享）
     try:
         yield agent
     finally:
@@ -5,8 +5,9 @@ from src.utils.security import verify_token
 
 
 security = HTTPBearer()
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """获取当前用户"""
+
+def _get_token_username(credentials: HTTPAuthorizationCredentials) -> str:
+    """从Bearer凭证中解析用户名，失败时抛出401"""
     token = credentials.credentials  # 从请求头获取token
     username = verify_token(token)  # 验证token
     if username is None:
@@ -14,6 +15,11 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token 认证失败！",
         )
+    return username
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """获取当前用户"""
+    username = _get_token_username(credentials)
         
     user = await user_repo.get_user_by_username(username)  # 获取用户信息
     if user is None:
@@ -22,4 +28,17 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="用户不存在！",
         )
         
+    return user
+
+async def get_current_user_with_personas(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """获取当前用户（同一查询中预加载 user.personas，供需要画像列表的路由使用）"""
+    username = _get_token_username(credentials)
+
+    user = await user_repo.get_user_by_username_with_personas(username)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="用户不存在！",
+        )
+        
     return user
\ No newline at end of file
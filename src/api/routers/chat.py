@@ -1,32 +1,55 @@
 import re
-import json
+import asyncio
 import hashlib
 import time
+from typing import Set
+
+import anyio
+import orjson
+from anyio.streams.memory import MemoryObjectSendStream
 from fastapi import APIRouter, Depends
 from fastapi.responses import StreamingResponse
+from agentscope.model import DashScopeChatModel
 from src.schemas.chat import ChatReq
 from src.db.models import User
-from src.api.deps import get_agent
+from src.agents.host_agent import HostAgent
+from src.api.deps import get_agent, get_chat_model, get_bg_tasks
 from src.api.routers.auth import get_current_user
+from src.utils.logger import logger
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+# SSE 帧前后缀（直接输出 bytes，避免逐块 str -> utf8 重编码）
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+# {"chunk": ...} 信封的固定前后缀：直接拼接序列化后的块，无需为每个块构造临时 dict
+_SSE_CHUNK_PREFIX = _SSE_PREFIX + b'{"chunk":'
+_SSE_CHUNK_SUFFIX = b"}" + _SSE_SUFFIX
+# 模型输出与网络写出之间的缓冲块数：客户端写出变慢时，模型可先行生成若干块
+_SSE_BUFFER_SIZE = 8
+
+# 会话密钥格式：session_{毫秒时间戳}_{随机串}_{8位校验串}，模块加载时预编译
+_SESSION_RE = re.compile(r'^session_(\d+)_[a-z0-9]+_[A-Za-z0-9+/]{8}$')
+
+# 敏感词（子串匹配、忽略大小写），单次扫描且无需先复制一份小写文本
+_FORBIDDEN_WORDS = ["password", "token", "secret"]
+_FORBIDDEN_RE = re.compile("|".join(map(re.escape, _FORBIDDEN_WORDS)), re.IGNORECASE)
+
 def validate_session_key(session_key: str) -> bool:
     """
     验证会话密钥的格式和时效性
     """
     try:
         # 检查格式
-        pattern = r'^session_\d+_[a-z0-9]+_[A-Za-z0-9+/]{8}$'
-        if not re.match(pattern, session_key):
+        m = _SESSION_RE.match(session_key)
+        if not m:
             return False
             
         # 解析时间戳
-        parts = session_key.split('_')
-        timestamp = int(parts[1])
+        timestamp = int(m.group(1))
         
         # 检查时效性（24小时）
-        current_time = int(time.time() * 1000)
+        current_time = time.time_ns() // 1_000_000
         if current_time - timestamp > 24 * 60 * 60 * 1000:
             return False
             
@@ -34,7 +57,16 @@ def validate_session_key(session_key: str) -> bool:
     except Exception:
         return False
 
-async def sse_stream(req: ChatReq):
+async def _produce_chunks(agent: HostAgent, instruction: str, send: MemoryObjectSendStream) -> None:
+    """生产者：读取模型流式输出并写入内存流；消费者已关闭时直接结束。"""
+    async with send:
+        try:
+            async for chunk in agent.stream_reply(instruction):
+                await send.send(chunk)
+        except anyio.BrokenResourceError:
+            pass
+
+async def sse_stream(req: ChatReq, model: DashScopeChatModel, bg_tasks: Set[asyncio.Task]):
     # 验证会话密钥
     if not validate_session_key(req.session_id):
         raise ValueError("Invalid session ID")
@@ -44,26 +76,41 @@ async def sse_stream(req: ChatReq):
         raise ValueError("Invalid instruction")
         
     # 检查敏感内容
-    forbidden_words = ["password", "token", "secret"]
-    if any(word in req.instruction.lower() for word in forbidden_words):
+    if _FORBIDDEN_RE.search(req.instruction):
         raise ValueError("Instruction contains forbidden content")
 
-    async with get_agent(session_id=req.session_id, user_id=req.user_id) as agent:
+    async with get_agent(session_id=req.session_id, user_id=req.user_id, model=model, bg_tasks=bg_tasks) as agent:
         last_chunk = None
-        async for chunk in agent.stream_reply(req.instruction):
-            last_chunk = chunk
-            yield f"data: {json.dumps({'chunk': chunk}, ensure_ascii=False)}\n\n"
+        send, recv = anyio.create_memory_object_stream(max_buffer_size=_SSE_BUFFER_SIZE)
+        producer = asyncio.create_task(_produce_chunks(agent, req.instruction, send))
+        try:
+            async with recv:
+                async for chunk in recv:
+                    last_chunk = chunk
+                    yield _SSE_CHUNK_PREFIX + orjson.dumps(chunk) + _SSE_CHUNK_SUFFIX
+            # 生产者异常在此抛出
+            await producer
+        except Exception as e:
+            # 流式输出不重试：发送终止错误事件，由前端提示用户
+            logger.warning("流式对话中断: session_id=%s, 原因: %s", req.session_id, e)
+            yield _SSE_PREFIX + orjson.dumps({"error": "对话服务暂时不可用，请稍后重试"}) + _SSE_SUFFIX
+            return
+        finally:
+            # 客户端断开等情况下终止仍在生成的模型输出
+            if not producer.done():
+                producer.cancel()
         if last_chunk:
-            usage = json.dumps(last_chunk.usage)
-            yield f"data: {usage}\n\n"
+            yield _SSE_PREFIX + orjson.dumps(last_chunk.usage) + _SSE_SUFFIX
 
 @router.post("/stream")
 def chat_stream(
     req: ChatReq, 
+    model: DashScopeChatModel = Depends(get_chat_model),
+    bg_tasks: Set[asyncio.Task] = Depends(get_bg_tasks),
     # current_user: User = Depends(get_current_user)
 ):
     return StreamingResponse(
-        sse_stream(req),
+        sse_stream(req, model, bg_tasks),
         media_type="text/event-stream",
     )
 
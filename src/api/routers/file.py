@@ -1,22 +1,37 @@
+import os
+import stat
+import mimetypes
+from functools import lru_cache
+from pathlib import PurePosixPath
 from typing import List, Optional
 
 from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ...db import User
 from ...schemas import UserFilePublic, FileType
 from ...repositories import file_repo
 from .auth import get_current_user
+from ..deps import get_db_session
 from ...utils import (
     logger,
     save_uploaded_file, 
     get_file_download_url,
     delete_user_file as delete_file_from_storage,
-    ensure_upload_directories,
     FileUploadError
 )
 
 router = APIRouter(prefix="/file", tags=["file"])
+# 文件列表整体校验
+_files_adapter = TypeAdapter(List[UserFilePublic])
+
+
+@lru_cache(maxsize=512)
+def _guess_media_type(extension: str) -> str:
+    """根据文件扩展名推断MIME类型（按扩展名缓存），未知类型回退为通用二进制流"""
+    return mimetypes.guess_type(f"file{extension}")[0] or "application/octet-stream"
 
 
 @router.post("/upload", response_model=UserFilePublic, status_code=status.HTTP_201_CREATED)
@@ -38,15 +53,12 @@ async def upload_file(
     如果提供session_id，文件将关联到指定会话；否则作为用户个人文件存储。
     """
     try:
-        # 确保上传目录存在
-        ensure_upload_directories()
-
         # 处理 session_id：空字符串转换为 None
         if session_id == "":
             session_id = None
 
         # 保存文件到存储系统
-        file_path, original_filename, file_size, file_type = await save_uploaded_file(
+        file_path, original_filename, file_size, file_type, content_digest = await save_uploaded_file(
             file, current_user.id, session_id
         )
 
@@ -62,14 +74,18 @@ async def upload_file(
             file_name=original_filename,
             file_size=file_size,
             mime_type=file.content_type,
-            description=description
+            description=description,
+            meta={"content_digest": content_digest},
         )
 
-        logger.info(f"文件记录创建成功: file_id={user_file.id}, user_id={current_user.id}, "
-                   f"session_id={session_id or 'personal'}")
+        logger.info("文件记录创建成功: file_id=%s, user_id=%s, session_id=%s",
+                    user_file.id, current_user.id, session_id or 'personal')
 
         return UserFilePublic.model_validate(user_file)
 
+    except HTTPException:
+        # 文件校验失败（大小超限、类型不支持）直接返回对应状态码
+        raise
     except FileUploadError as e:
         logger.error(f"文件上传失败: {str(e)}")
         raise HTTPException(
@@ -99,10 +115,9 @@ async def download_file(
         # 文件路径格式: static/uploading/{user_id}/{session_id}/{file_id}_{filename}
         # 或: static/uploading/{user_id}/personal/{file_id}_{filename}
         # 注意：Windows系统使用\分隔符，需要处理两种分隔符
-        normalized_path = file_path.replace('\\', '/')
-        path_parts = normalized_path.split('/')
+        path_parts = PurePosixPath(file_path.replace('\\', '/')).parts
         
-        if len(path_parts) < 4 or path_parts[0] != 'static' or path_parts[1] != 'uploading':
+        if len(path_parts) < 4 or path_parts[:2] != ('static', 'uploading') or '..' in path_parts:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="无效的文件路径"
@@ -118,11 +133,14 @@ async def download_file(
             )
         
         # 构建完整的文件路径
-        full_file_path = str(Path(file_path))
+        full_file_path = '/'.join(path_parts)
         
-        # 检查文件是否存在
-        import os
-        if not os.path.exists(full_file_path):
+        # 检查文件是否存在：只 stat 一次，结果交给 FileResponse 复用，避免其再次 stat
+        try:
+            file_stat = os.stat(full_file_path)
+        except OSError:
+            file_stat = None
+        if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="文件不存在"
@@ -132,28 +150,12 @@ async def download_file(
         filename_part = path_parts[-1]
         original_filename = '_'.join(filename_part.split('_')[1:])  # 移除UUID前缀
         
-        # 根据文件扩展名设置正确的MIME类型
-        file_extension = Path(original_filename).suffix.lower()
-        media_type = "application/octet-stream"  # 默认通用类型
-        
-        if file_extension == '.pdf':
-            media_type = 'application/pdf'
-        elif file_extension in ['.jpg', '.jpeg']:
-            media_type = 'image/jpeg'
-        elif file_extension == '.png':
-            media_type = 'image/png'
-        elif file_extension == '.gif':
-            media_type = 'image/gif'
-        elif file_extension == '.txt':
-            media_type = 'text/plain'
-        elif file_extension in ['.doc', '.docx']:
-            media_type = 'application/msword'
-        
         # 返回文件
         return FileResponse(
             path=full_file_path,
             filename=original_filename,
-            media_type=media_type,
+            media_type=_guess_media_type(PurePosixPath(original_filename).suffix.lower()),
+            stat_result=file_stat,
             headers={
                 "Content-Disposition": f"attachment; filename=\"{original_filename}\""
             }
@@ -198,7 +200,10 @@ async def list_files(
                 current_user.id, include_inactive
             )
         
-        return [UserFilePublic.model_validate(f) for f in files]
+        # 由 pydantic-core 直接序列化为 JSON 字节并返回 Response：
+        # 跳过 FastAPI 按 response_model 对每个元素的再次校验与中间 dict 构造（response_model 仍用于文档）
+        validated = _files_adapter.validate_python(files, from_attributes=True)
+        return Response(content=_files_adapter.dump_json(validated), media_type="application/json")
         
     except Exception as e:
         logger.error(f"获取文件列表失败: {str(e)}")
@@ -211,7 +216,8 @@ async def list_files(
 @router.delete("/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_file(
     file_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db_session),
 ):
     """
     删除文件（软删除）
@@ -219,41 +225,45 @@ async def delete_file(
     将文件标记为非活跃状态，并将物理文件移动到temp文件夹
     """
     try:
-        # 获取文件记录
-        user_file = await file_repo.get_user_file(file_id)
-        if not user_file:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="文件不存在"
-            )
+        # 查询与软删除共用同一连接，在一个事务中提交
+        async with session.begin():
+            # 获取文件归属与路径（只取这两列）
+            user_file = await file_repo.get_file_owner_and_url(file_id, session=session)
+            if not user_file:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="文件不存在"
+                )
         
-        # 检查权限
-        if user_file.user_id != current_user.id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="无权删除此文件"
-            )
+            # 检查权限
+            if user_file.user_id != current_user.id:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="无权删除此文件"
+                )
         
-        # 从file_url中提取实际文件路径
-        # file_url格式: /file/download/static/uploading/{user_id}/{session_id}/{file_id}_{filename}
-        # 需要移除前面的"/file/download/"部分
-        if user_file.file_url.startswith("/file/download/"):
-            file_path = user_file.file_url.replace("/file/download/", "")
-        else:
-            file_path = user_file.file_url
+            # 从file_url中提取实际文件路径
+            # file_url格式: /file/download/static/uploading/{user_id}/{session_id}/{file_id}_{filename}
+            # 需要移除前面的"/file/download/"部分
+            if user_file.file_url.startswith("/file/download/"):
+                file_path = user_file.file_url.replace("/file/download/", "")
+            else:
+                file_path = user_file.file_url
+            # file_url 以 "/" 开头（见 get_file_download_url），实际文件路径相对项目根目录
+            file_path = file_path.lstrip("/")
         
-        # 移动物理文件到temp文件夹
-        await delete_file_from_storage(file_path)
+            # 移动物理文件到temp文件夹
+            await delete_file_from_storage(file_path, user_file.content_digest)
         
-        # 软删除数据库记录
-        success = await file_repo.delete_user_file(file_id)
-        if not success:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="文件删除失败"
-            )
+            # 软删除数据库记录
+            success = await file_repo.delete_user_file(file_id, session=session)
+            if not success:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="文件删除失败"
+                )
         
-        logger.info(f"文件删除成功: file_id={file_id}, user_id={current_user.id}, file_moved_to_temp=True")
+        logger.info("文件删除成功: file_id=%s, user_id=%s, file_moved_to_temp=True", file_id, current_user.id)
         
     except HTTPException:
         raise
@@ -1,6 +1,7 @@
 from typing import List
 
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Response
+from pydantic import TypeAdapter
 
 from src.db.models import User
 from src.schemas.session import SessionPublic
@@ -8,6 +9,8 @@ from src.api.routers.auth import get_current_user
 from src.repositories import user_repo, chat_repo
 
 router = APIRouter(prefix="/session", tags=["session"])
+# 会话列表整体校验，见 user.py 中 _personas_adapter
+_sessions_adapter = TypeAdapter(List[SessionPublic])
 
 @router.get("/uid/{user_id}", response_model=List[SessionPublic], status_code=status.HTTP_200_OK)
 async def get_chat_sessions(
@@ -21,7 +24,9 @@ async def get_chat_sessions(
             status_code=status.HTTP_404_NOT_FOUND,
             detail = "Chat sessions Not Found!"
         )
-    return [SessionPublic.model_validate(sess) for sess in sessions]
+    # 直接返回序列化好的 JSON 字节，见 file.py 的 /list
+    validated = _sessions_adapter.validate_python(sessions, from_attributes=True)
+    return Response(content=_sessions_adapter.dump_json(validated), media_type="application/json")
 
 @router.get("/msgs/{session_id}", status_code=status.HTTP_200_OK)
 async def get_chat_messages(
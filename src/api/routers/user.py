@@ -1,41 +1,56 @@
 from typing import List
 
-from fastapi import APIRouter, HTTPException, status, Response, Depends
-from fastapi.security import HTTPBearer
+from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
 from src.repositories import user_repo, persona_repo
 from src.schemas.user import UserCreate, UserUpdate, UserPublic, UserLogin, UserAuthResponse
 from src.schemas.persona import PersonaCreate, PersonaPublic, PersonaUpdate
-from src.utils.security import verify_password, create_access_token
+from src.utils.security import verify_password, get_password_hash, password_needs_update, create_access_token
 from src.db.models import User
 from src.utils.logger import logger
-from src.api.routers.auth import get_current_user
+from src.api.routers.auth import get_current_user, get_current_user_with_personas
+from src.api.deps import get_db_session
+from src.agents import _persona_cache
 
 router = APIRouter(prefix="/user", tags=["user"])
-# security = HTTPBearer()  # 创建Bearer认证实例
+# 列表序列化适配器：整个列表一次交给 pydantic-core 校验，避免逐条 model_validate
+_personas_adapter = TypeAdapter(List[PersonaPublic])
+# 读接口直接返回 pydantic-core 序列化好的 JSON 字节（同 file.py 的 /list），
+# 跳过 FastAPI 按 response_model 的再次校验与 jsonable_encoder 遍历；response_model 仍用于文档
+_user_adapter = TypeAdapter(UserPublic)
+_persona_adapter = TypeAdapter(PersonaPublic)
 
 @router.post("/register", response_model=UserAuthResponse, status_code=status.HTTP_201_CREATED)
-async def create_user(user_in: UserCreate):
+async def create_user(user_in: UserCreate, session: AsyncSession = Depends(get_db_session)):
     """
     创建新用户。
+    查重、创建用户与默认画像共用一个连接，在同一事务中提交。
     """
-    if await user_repo.get_user_by_username(user_in.username):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="This username is already taken!",
+    async with session.begin():
+        username_taken, email_taken = await user_repo.get_conflicts(
+            user_in.username, user_in.email, session=session
         )
-    if user_in.email and await user_repo.get_user_by_email(user_in.email):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="This email is already in use!",
+        if username_taken:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="This username is already taken!",
+            )
+        if email_taken:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="This email is already in use!",
+            )
+        
+        user = await user_repo.create_user(user_in, session=session)
+        # 创建默认persona
+        await persona_repo.create_persona(
+            user_id=user.id,
+            name="default_persona",
+            is_default=True,
+            session=session,
         )
-    
-    user = await user_repo.create_user(user_in)
-    # 创建默认persona
-    await persona_repo.create_persona(
-        user_id=user.id,
-        name="default_persona",
-        is_default=True
-    )
 
     access_token = create_access_token(data={"sub": user.username})
     return {
@@ -44,19 +59,35 @@ async def create_user(user_in: UserCreate):
         "user": UserPublic.model_validate(user)
     }
 
+async def _rehash_password(user_id: str, password: str) -> None:
+    """登录成功后将旧哈希（如 bcrypt）升级为当前算法；哈希计算放到线程池，避免阻塞事件循环"""
+    try:
+        hashed_password = await run_in_threadpool(get_password_hash, password)
+        await user_repo.update_password_hash(user_id, hashed_password)
+    except Exception as e:
+        logger.error(f"用户密码哈希升级失败! user_id={user_id}, 错误信息: {str(e)}")
+
 @router.post("/login", response_model=UserAuthResponse, status_code=status.HTTP_200_OK)
-async def login(user_in: UserLogin):
+async def login(
+    user_in: UserLogin,
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_db_session),
+):
     """用户登录"""
-    user = await user_repo.get_user_by_username(user_in.username)  # 获取用户
+    user = await user_repo.get_user_by_username(user_in.username, session=session)  # 获取用户
     if not user or not verify_password(user_in.password, user.hashed_password):  # 验证密码
-        logger.warning(f"用户【{user_in.username}】登录失败!")
+        logger.warning("用户【%s】登录失败!", user_in.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Username or password is incorrect!",
         )
-    logger.info(f"用户【{user_in.username}】登录成功!")
+    logger.info("用户【%s】登录成功!", user_in.username)
     access_token = create_access_token(data={"sub": user.username})  # 创建token
-    await user_repo.update_last_login(user.id)  # 更新最后登录时间
+    await user_repo.update_last_login(user.id, session=session)  # 更新最后登录时间
+    await session.commit()
+    if password_needs_update(user.hashed_password):
+        # 响应返回后再升级哈希，不增加登录延迟
+        background_tasks.add_task(_rehash_password, user.id, user_in.password)
     return {
         "access_token": access_token,
         "token_type": "bearer",
@@ -66,49 +97,55 @@ async def login(user_in: UserLogin):
 @router.get("/me", response_model=UserPublic, status_code=status.HTTP_200_OK)
 async def read_users_me(current_user: User = Depends(get_current_user)):
     """获取当前用户信息"""
-    return current_user
+    validated = _user_adapter.validate_python(current_user, from_attributes=True)
+    return Response(content=_user_adapter.dump_json(validated), media_type="application/json")
 
 @router.post("/persona", response_model=PersonaPublic, status_code=status.HTTP_200_OK)
 async def create_persona(
     persona_in: PersonaCreate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db_session),
 ):
     """
     创建新的用户画像
     """
-    # 检查是否已存在同name persona
-    existing_personas = await persona_repo.get_persona(current_user.id)
-    if any(p.name == persona_in.name for p in existing_personas):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="The name of persona already exists!"
+    # 查重、取消其他默认画像与创建新画像在同一事务中完成，只提交一次
+    async with session.begin():
+        # 检查是否已存在同name persona
+        if await persona_repo.persona_name_exists(current_user.id, persona_in.name, session=session):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="The name of persona already exists!"
+            )
+
+        # 确保用户只能有一个默认画像
+        if persona_in.is_default:
+            # 将该用户的其他画像设为非默认
+            await persona_repo.update_user_default_personas(current_user.id, False, session=session)
+
+        # 创建新的画像
+        persona = await persona_repo.create_persona(
+            user_id=current_user.id,
+            name=persona_in.name,
+            tags=persona_in.tags,
+            profile=persona_in.profile,
+            is_default=persona_in.is_default,
+            session=session,
         )
-    
-    # 确保用户只能有一个默认画像
-    if persona_in.is_default:
-        # 将该用户的其他画像设为非默认
-        await persona_repo.update_user_default_personas(current_user.id, False)
-
-    # 创建新的画像
-    persona = await persona_repo.create_persona(
-        user_id=current_user.id,
-        name=persona_in.name,
-        tags=persona_in.tags,
-        profile=persona_in.profile,
-        is_default=persona_in.is_default
-    )
+    # 画像变更后使聊天侧的画像缓存失效
+    _persona_cache.invalidate(user_id=current_user.id)
     
     return PersonaPublic.model_validate(persona)
 
 @router.get("/persona", response_model=List[PersonaPublic], status_code=status.HTTP_200_OK)
 async def get_user_personas(
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user_with_personas)
 ):
     """
     获取当前用户的所有画像
     """
-    personas = await persona_repo.get_persona(current_user.id)
-    return [PersonaPublic.model_validate(p) for p in personas]
+    validated = _personas_adapter.validate_python(current_user.personas, from_attributes=True)
+    return Response(content=_personas_adapter.dump_json(validated), media_type="application/json")
 
 @router.get("/persona/{persona_id}", response_model=PersonaPublic, status_code=status.HTTP_200_OK)
 async def get_persona(
@@ -134,55 +171,61 @@ async def get_persona(
             detail="Not authorized to access this persona!"
         )
     
-    return PersonaPublic.model_validate(persona)
+    validated = _persona_adapter.validate_python(persona, from_attributes=True)
+    return Response(content=_persona_adapter.dump_json(validated), media_type="application/json")
 
 @router.put("/persona/{persona_id}", response_model=PersonaPublic, status_code=status.HTTP_200_OK)
 async def update_persona(
     persona_in: PersonaUpdate,
     persona_id: str, 
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db_session),
 ):
     """
     更新用户画像
     """
-    # 获取现有画像
-    persona = await persona_repo.get_persona_pid(persona_id)
-    
-    # 检查画像是否存在
-    if not persona:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Persona not found!"
-        )
-    
-    # 检查用户是否有权限更新该画像
-    if persona.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to update this persona!"
-        )
-    
-    # 如果要更新name，检查新name是否已被该用户的其他persona使用
-    if persona_in.name and persona_in.name != persona.name:
-        existing_personas = await persona_repo.get_persona(current_user.id)
-        if any(p.name == persona_in.name for p in existing_personas):
+    # 校验、取消其他默认画像与更新画像在同一事务中完成，只提交一次
+    async with session.begin():
+        # 获取现有画像
+        persona = await persona_repo.get_persona_pid(persona_id, session=session)
+        
+        # 检查画像是否存在
+        if not persona:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="The name of persona already exists!"
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Persona not found!"
+            )
+        
+        # 检查用户是否有权限更新该画像
+        if persona.user_id != current_user.id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not authorized to update this persona!"
             )
+        
+        # 如果要更新name，检查新name是否已被该用户的其他persona使用
+        if persona_in.name and persona_in.name != persona.name:
+            if await persona_repo.persona_name_exists(current_user.id, persona_in.name, session=session):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="The name of persona already exists!"
+                )
 
-    # 如果设置为默认，则将其他画像设为非默认
-    if persona_in.is_default and not persona.is_default:
-        await persona_repo.update_user_default_personas(current_user.id, False)
-    
-    # 更新画像
-    updated_persona = await persona_repo.update_persona(
-        persona_id=persona_id,
-        name=persona_in.name,
-        tags=persona_in.tags,
-        profile=persona_in.profile,
-        is_default=persona_in.is_default
-    )
+        # 如果设置为默认，则将其他画像设为非默认
+        if persona_in.is_default and not persona.is_default:
+            await persona_repo.update_user_default_personas(current_user.id, False, session=session)
+        
+        # 更新画像
+        updated_persona = await persona_repo.update_persona(
+            persona_id=persona_id,
+            name=persona_in.name,
+            tags=persona_in.tags,
+            profile=persona_in.profile,
+            is_default=persona_in.is_default,
+            session=session,
+        )
+    # 画像变更后使聊天侧的画像缓存失效
+    _persona_cache.invalidate(user_id=current_user.id, persona_id=persona_id)
     
     return PersonaPublic.model_validate(updated_persona)
 
@@ -196,31 +239,40 @@ async def get_user(user_id: str):
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found!")
     
-    return user
+    validated = _user_adapter.validate_python(user, from_attributes=True)
+    return Response(content=_user_adapter.dump_json(validated), media_type="application/json")
 
 @router.put("/me", response_model=UserPublic, status_code=status.HTTP_200_OK)
-async def update_user(user_in: UserUpdate, current_user: User = Depends(get_current_user)):
+async def update_user(
+    user_in: UserUpdate,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_db_session),
+):
     """
     更新当前用户信息。
     """
-    # 检查新的 username 或 email 是否已被其他用户占用
-    if user_in.username and (existing_user := await user_repo.get_user_by_username(user_in.username)) and existing_user.id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already taken!")
-    if user_in.email and (existing_user := await user_repo.get_user_by_email(user_in.email)) and existing_user.id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already taken!")
+    async with session.begin():
+        # 检查新的 username 或 email 是否已被其他用户占用
+        username_taken, email_taken = await user_repo.get_conflicts(
+            user_in.username, user_in.email, exclude_user_id=current_user.id, session=session
+        )
+        if username_taken:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already taken!")
+        if email_taken:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already taken!")
 
-    updated_user = await user_repo.update_user(current_user.id, user_in)
+        updated_user = await user_repo.update_user(current_user.id, user_in, session=session)
     return updated_user
 
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user(user_id: str):
     """
-    删除用户。
+    删除用户（尚未实现）。
+    显式返回 501，避免客户端误以为删除成功。
     """
-    # success = await user_repo.delete_user(user_id)
-    # if not success:
-    #     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="用户未找到")
-    # return Response(status_code=status.HTTP_204_NO_CONTENT)
-    pass
+    raise HTTPException(
+        status_code=status.HTTP_501_NOT_IMPLEMENTED,
+        detail="User deletion is not implemented yet!",
+    )
 
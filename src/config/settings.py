@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from typing import List
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
@@ -12,9 +13,16 @@ class Settings(BaseSettings):
     TEMPERATURE: float = float(os.getenv("TEMPERATURE", "0.7"))
     SECRET_KEY: str = os.getenv("SECRET_KEY", "kidsaitutoristhebestaicompansionforyourkidslearning")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "120"))
+
+    # 密码哈希（argon2id）成本参数：按登录接口目标延迟调整
+    ARGON2_TIME_COST: int = int(os.getenv("ARGON2_TIME_COST", "2"))
+    ARGON2_MEMORY_COST: int = int(os.getenv("ARGON2_MEMORY_COST", "19456"))  # KiB
+    ARGON2_PARALLELISM: int = int(os.getenv("ARGON2_PARALLELISM", "1"))
     
     # 文件上传配置
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "static/uploading")
+    # 上传内容去重存储（按内容摘要命名的硬链接）：不能放在对外挂载的 static 目录下，且需与 UPLOAD_DIR 位于同一文件系统
+    CONTENT_STORE_DIR: str = os.getenv("CONTENT_STORE_DIR", "file_store")
     MAX_FILE_SIZE: int = int(os.getenv("MAX_FILE_SIZE", "104857600"))  # 100MB
     ALLOWED_MIME_TYPES: List[str] = [
         "image/jpeg", "image/png", "image/gif", "image/webp",
@@ -24,5 +32,10 @@ class Settings(BaseSettings):
         "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
     ]
 
+@lru_cache
+def get_settings() -> Settings:
+    """获取配置单例（首次调用时构建，之后复用同一实例）"""
+    return Settings()
+
 # 全局配置实例
-settings = Settings()
+settings = get_settings()
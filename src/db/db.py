@@ -1,10 +1,13 @@
 from __future__ import annotations
+import json
 import os
 from pathlib import Path
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import Optional, AsyncIterator
 
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy import event
+from pydantic import BaseModel
 
 from src.db.models import Base
 
@@ -12,24 +15,77 @@ from src.db.models import Base
 ROOT_DIR = Path(__file__).parent.parent.parent
 DB_DIR = os.path.join(ROOT_DIR, "database")
 
-os.makedirs(DB_DIR, exist_ok=True)
-DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite+aiosqlite:///{DB_DIR}/agentic_tutor.db")
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    # 仅使用默认 SQLite 文件时才需要该目录；已存在则不再 mkdir
+    if not os.path.isdir(DB_DIR):
+        os.makedirs(DB_DIR, exist_ok=True)
+    DATABASE_URL = f"sqlite+aiosqlite:///{DB_DIR}/agentic_tutor.db"
+
+# PostgreSQL 统一使用原生异步驱动 asyncpg（psycopg2 等同步驱动会经线程池执行，阻塞事件循环）
+for _pg_prefix in ("postgres://", "postgresql://", "postgresql+psycopg2://"):
+    if DATABASE_URL.startswith(_pg_prefix):
+        DATABASE_URL = "postgresql+asyncpg://" + DATABASE_URL[len(_pg_prefix):]
+        break
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+IS_ASYNCPG = DATABASE_URL.startswith("postgresql+asyncpg")
+
+if IS_SQLITE:
+    # SQLite 写锁等待上限（秒），避免长时间卡在 "database is locked"
+    _CONNECT_ARGS = {"timeout": 5}
+elif IS_ASYNCPG:
+    # 关闭 JIT：本项目均为短小的 OLTP 查询，JIT 编译开销远大于收益；
+    # 放大每连接的预编译语句缓存，热点查询在服务端只解析、规划一次
+    _CONNECT_ARGS = {"server_settings": {"jit": "off"}, "prepared_statement_cache_size": 500}
+else:
+    _CONNECT_ARGS = {}
+
+# 连接池大小：并发 SSE 流较多时可通过环境变量调大（建议 ≥ 单进程并发请求数）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# 连接池耗尽时的等待上限（秒）：快速失败，而不是让请求挂起默认的 30 秒
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# 连接最长复用时间（秒），避免长期持有的连接被服务端/中间件断开
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+def _json_serializer(value) -> str:
+    """
+    JSON 列的序列化函数：
+    - pydantic 模型（如 ProfileConfig，见 ProfileConfigJSON）由 pydantic-core 一次输出 JSON 文本，不再先转 dict 再 json.dumps
+    - 其他值保持 json.dumps 的原有行为
+    """
+    if isinstance(value, BaseModel):
+        return value.model_dump_json()
+    return json.dumps(value)
 
 engine = create_async_engine(
     DATABASE_URL,
     echo=False,
     future=True,
-    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    # 本地 SQLite 文件连接不会被服务端断开，无需每次取连接前额外 ping 一次
+    pool_pre_ping=not IS_SQLITE,
+    connect_args=_CONNECT_ARGS,
+    json_serializer=_json_serializer,
 )
 
-# SQLite 优化：WAL、降低同步级别、开启外键
-@event.listens_for(engine.sync_engine, "connect")
-def _sqlite_on_connect(dbapi_conn, connection_record):
-    cursor = dbapi_conn.cursor()
-    cursor.execute("PRAGMA journal_mode=WAL;")
-    cursor.execute("PRAGMA synchronous=NORMAL;")
-    cursor.execute("PRAGMA foreign_keys=ON;")
-    cursor.close()
+# SQLite 优化：WAL、降低同步级别、开启外键、内存映射与页缓存（仅 SQLite；切换到如 postgresql+asyncpg 时不注册）
+if IS_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_on_connect(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL;")
+        cursor.execute("PRAGMA synchronous=NORMAL;")
+        cursor.execute("PRAGMA foreign_keys=ON;")
+        cursor.execute("PRAGMA mmap_size=268435456;")  # 256MB 内存映射，读历史消息时少走 read() 系统调用
+        cursor.execute("PRAGMA cache_size=-65536;")    # 每连接 64MB 页缓存（负数单位为 KiB）
+        cursor.execute("PRAGMA temp_store=MEMORY;")
+        cursor.execute("PRAGMA wal_autocheckpoint=1000;")
+        cursor.close()
 
 SessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
@@ -70,17 +126,14 @@ class DatabaseManager:
         """
         获取数据库会话的属性方法。
         每次调用此属性都会返回一个新的数据库会话。
-        如果数据库尚未初始化，则先进行初始化。
+        必须先在应用启动时（lifespan）调用 `await db_manager.initialize()`；
+        属性方法无法在运行中的事件循环里同步完成异步初始化，因此未初始化时直接报错。
 
         返回:
         AsyncSession: 异步数据库会话对象
         """
         if not self._initialized:
-            # 这里需要同步初始化，因为属性方法不能是异步的
-            # 我们可以使用事件循环来运行异步初始化
-            import asyncio
-            loop = asyncio.get_event_loop()
-            loop.run_until_complete(self.initialize())
+            raise RuntimeError("db_manager not initialized, call `await db_manager.initialize()` first")
         return SessionLocal()  # 创建并返回新的数据库会话
 
     async def close(self):
@@ -89,6 +142,19 @@ class DatabaseManager:
             await engine.dispose()
             self._initialized = False
 
+@asynccontextmanager
+async def session_scope(session: Optional[AsyncSession] = None) -> AsyncIterator[AsyncSession]:
+    """
+    仓储函数使用的会话上下文：
+    - 传入 session（如请求级会话）时直接复用，由调用方所在事务统一提交（多步写入只占用一个连接、只提交一次）
+    - 未传入时自行开启会话与事务，结束时提交
+    """
+    if session is not None:
+        yield session
+        return
+    async with db_manager.session as own_session, own_session.begin():
+        yield own_session
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
@@ -4,8 +4,8 @@ from datetime import datetime
 from typing import Optional, Dict, Any, List
 
 from sqlalchemy import String, Text, DateTime, ForeignKey, Index, text, Integer, Boolean
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy.types import JSON
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, query_expression
+from sqlalchemy.types import JSON, TypeDecorator
 
 from ..schemas import (
     LearningConfig, 
@@ -15,16 +15,52 @@ from ..schemas import (
 from ..utils import logger
 
 
+# 主键使用32位无连字符的十六进制UUID（较带连字符的36位形式更短，索引页可容纳更多行）
+# 外键列类型由 ForeignKey 从被引用列推断，自动保持一致。
+# 已有数据库中的36位ID仍可正常使用（SQLite 不校验 VARCHAR 长度）。
 def gen_uuid_str() -> str:
-    return str(uuid.uuid4())
+    return uuid.uuid4().hex
+
+# LearningConfig 字段说明在运行期不变，导入时解析一次
+_LEARNING_FIELD_DESC: Dict[str, str] = {
+    name: field.description or "" for name, field in LearningConfig.model_fields.items()
+}
+
+# 默认画像只构建一次：只读场景直接使用该实例；需要独立副本时用 model_copy 深拷贝，不再重新构造和校验各分组
+_DEFAULT_PROFILE: ProfileConfig = ProfileConfig()
+
+def default_profile() -> ProfileConfig:
+    """返回一份新的默认画像（用作 Persona.profile 的列默认值，写入时无需再校验）"""
+    return _DEFAULT_PROFILE.model_copy(deep=True)
 
 class Base(DeclarativeBase):
     pass
 
+class ProfileConfigJSON(TypeDecorator):
+    """
+    以 JSON 存储的 ProfileConfig：
+    - 写入时接受 ProfileConfig 或 dict，统一校验为 ProfileConfig，由引擎的 json_serializer 直接输出 JSON 文本
+    - 读出时校验为 ProfileConfig，加载一次即可直接使用，无需每次编译提示词都重新校验
+    """
+    impl = JSON
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, ProfileConfig):
+            value = ProfileConfig.model_validate(value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return ProfileConfig.model_validate(value)
+
 class User(Base):
     __tablename__ = "users"
 
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=gen_uuid_str)
+    id: Mapped[str] = mapped_column(String(32), primary_key=True, default=gen_uuid_str)
     username: Mapped[Optional[str]] = mapped_column(String(64), unique=True, index=True)
     display_name: Mapped[Optional[str]] = mapped_column(String(128))
     email: Mapped[Optional[str]] = mapped_column(String(128), unique=True, index=True)
@@ -59,11 +95,11 @@ class User(Base):
 class Persona(Base):
     __tablename__ = "personas"
 
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=gen_uuid_str)
+    id: Mapped[str] = mapped_column(String(32), primary_key=True, default=gen_uuid_str)
     user_id: Mapped[str] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)
     name: Mapped[str] = mapped_column(String(64))  
      # 结构化画像（编辑、版本管理、可查询/可控）。通过mapped_column(JSON)可以直接存储和查询JSON数据。
-    profile: Mapped[ProfileConfig] = mapped_column(JSON, default=ProfileConfig().model_dump())
+    profile: Mapped[ProfileConfig] = mapped_column(ProfileConfigJSON, default=default_profile)
     tags: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)  # 可选标签，逗号分隔
     is_default: Mapped[bool] = mapped_column(default=False)
 
@@ -88,55 +124,65 @@ class Persona(Base):
     def get_default_template(cls) -> Dict[str, Any]:
         return {
             "name": "default_profile",
-            "profile": ProfileConfig().model_dump()
+            "profile": default_profile()
         }
 
     def compile_profile_prompt(self) -> str:
-        # 获取字段的description
-        def get_field_description(model_class: type, field_name: str) -> str:
-            return model_class.model_fields[field_name].description or ""
-        
-        if self.profile is None:
-            self.profile = ProfileConfig().model_dump()
-        # 将字典转换为ProfileConfig对象
-        profile_config = ProfileConfig.model_validate(self.profile)
+        """
+        将结构化画像编译为提示词文本。
+        编译结果由 src/agents/_persona_cache 统一缓存并负责失效，这里不再另做缓存。
+        """
+        # 从数据库加载的 profile 已是 ProfileConfig（见 ProfileConfigJSON）；
+        # 尚未写入/刷新的实例上可能仍是 dict，此时才需要校验
+        profile_config = self.profile
+        if profile_config is None:
+            profile_config = _DEFAULT_PROFILE  # 只读使用，无需复制
+        elif not isinstance(profile_config, ProfileConfig):
+            profile_config = ProfileConfig.model_validate(profile_config)
+        # 各分组只取一次，避免下方逐字段重复经过 profile_config 的属性查找
+        identity = profile_config.identity
+        learning = profile_config.learning
+        motivation = profile_config.motivation
+        communication = profile_config.communication
+        safety = profile_config.safety
+        meta = profile_config.meta
         # identity
-        nickname = profile_config.identity.nickname
-        birth_month = profile_config.identity.birth_month
-        grade_level = profile_config.identity.grade_level
-        locale = profile_config.identity.locale
-        timezone = profile_config.identity.timezone
-        primary_language = profile_config.identity.primary_language
-        CEFR_level = profile_config.identity.CEFR_level
+        nickname = identity.nickname
+        birth_month = identity.birth_month
+        grade_level = identity.grade_level
+        locale = identity.locale
+        timezone = identity.timezone
+        primary_language = identity.primary_language
+        CEFR_level = identity.CEFR_level
         # learning
-        strengths = profile_config.learning.strengths
-        challenges = profile_config.learning.challenges
-        goals = profile_config.learning.goals
-        subjects_focus = profile_config.learning.subjects_focus
-        preferred_modalities = profile_config.learning.preferred_modalities
-        pace = profile_config.learning.pace.value
-        scaffolding_level = profile_config.learning.scaffolding_level.value
-        examples_preference = profile_config.learning.examples_preference.value
-        error_correction_style = profile_config.learning.error_correction_style.value
+        strengths = learning.strengths
+        challenges = learning.challenges
+        goals = learning.goals
+        subjects_focus = learning.subjects_focus
+        preferred_modalities = learning.preferred_modalities
+        pace = learning.pace.value
+        scaffolding_level = learning.scaffolding_level.value
+        examples_preference = learning.examples_preference.value
+        error_correction_style = learning.error_correction_style.value
         # motivation
-        tone = profile_config.motivation.tone.value
-        praise_frequency = profile_config.motivation.praise_frequency.value
-        interests = profile_config.motivation.interests
-        emotion_checkin = profile_config.motivation.emotion_checkin
-        growth_mindset = profile_config.motivation.growth_mindset
+        tone = motivation.tone.value
+        praise_frequency = motivation.praise_frequency.value
+        interests = motivation.interests
+        emotion_checkin = motivation.emotion_checkin
+        growth_mindset = motivation.growth_mindset
         # communication
-        emoji = profile_config.communication.emoji
-        step_by_step = profile_config.communication.step_by_step
-        ask_first = profile_config.communication.ask_before_answer
+        emoji = communication.emoji
+        step_by_step = communication.step_by_step
+        ask_first = communication.ask_before_answer
         # routines
         # assessment
         # agent
-        external_links_allowed = profile_config.safety.external_links_allowed
+        external_links_allowed = safety.external_links_allowed
         # safety
-        content_level = profile_config.safety.content_level.value
-        prohibited_topics = profile_config.safety.prohibited_topics
+        content_level = safety.content_level
+        prohibited_topics = safety.prohibited_topics
         # others
-        notes = profile_config.meta.notes
+        notes = meta.notes
         lines = []
         
         lines.append(f"你是一名面向`K-12`用户的耐心AI导师，请用`{tone}`的语气，并称呼用户为`{nickname}`。")
@@ -174,27 +220,27 @@ class Persona(Base):
         if preferred_modalities:
             lines.append(
                 f"与AI交互偏好：`{'、'.join(preferred_modalities)}`。"
-                f"（字段解释：{get_field_description(LearningConfig, "preferred_modalities")}）"
+                f"（字段解释：{_LEARNING_FIELD_DESC["preferred_modalities"]}）"
             )
 
-        lines.append(f"学习节奏：`{pace}`。（字段解释：{get_field_description(LearningConfig, "pace")}）")
+        lines.append(f"学习节奏：`{pace}`。（字段解释：{_LEARNING_FIELD_DESC["pace"]}）")
         
-        lines.append(f"提供学习支架(Scaffolding_level)：`{scaffolding_level}`。（字段解释：{get_field_description(LearningConfig, "scaffolding_level")}）")
+        lines.append(f"提供学习支架(Scaffolding_level)：`{scaffolding_level}`。（字段解释：{_LEARNING_FIELD_DESC["scaffolding_level"]}）")
         
-        lines.append(f"当需要举例说明时，符合以下用户偏好：`{examples_preference}`。（字段解释：{get_field_description(LearningConfig, "examples_preference")}）")
+        lines.append(f"当需要举例说明时，符合以下用户偏好：`{examples_preference}`。（字段解释：{_LEARNING_FIELD_DESC["examples_preference"]}）")
         
-        lines.append(f"错误纠正风格：`{error_correction_style}`。（字段解释：{get_field_description(LearningConfig, "error_correction_style")}）")
+        lines.append(f"错误纠正风格：`{error_correction_style}`。（字段解释：{_LEARNING_FIELD_DESC["error_correction_style"]}）")
         # motivation
         lines.append(f"表扬用户频率：`{praise_frequency}`。")
         
         if emotion_checkin:
-            lines.append(f"对话开始先用一句轻松的问候了解用户状态，鼓励表达感受。用户未回应无需再问。")
+            lines.append("对话开始先用一句轻松的问候了解用户状态，鼓励表达感受。用户未回应无需再问。")
         
         if growth_mindset:
-            lines.append(f"鼓励用户保持积极的学习态度，并强调学习过程中的进步。")
+            lines.append("鼓励用户保持积极的学习态度，并强调学习过程中的进步。")
         # communication
         if emoji:
-            lines.append(f"在对话中使用emoji表情，降低长篇文字压迫感。")
+            lines.append("在对话中使用emoji表情，降低长篇文字压迫感。")
         
         lines.append(
             f"讲解方式：{'逐步讲解，避免直接给出最终答案。' if step_by_step else '整体讲解，明确答案。'}"
@@ -208,7 +254,7 @@ class Persona(Base):
         lines.append(f"严格遵循`{content_level}`内容等级，不涉及以下话题：`{', '.join(prohibited_topics) if prohibited_topics else '无'}`。")
         
         if not external_links_allowed:
-            lines.append(f"禁止使用外部链接，除非有明确指示。")
+            lines.append("禁止使用外部链接，除非有明确指示。")
         # meta
         if notes:
             lines.append(f"用户额外备注：{notes}")
@@ -219,7 +265,7 @@ class Persona(Base):
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
 
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=gen_uuid_str)
+    id: Mapped[str] = mapped_column(String(32), primary_key=True, default=gen_uuid_str)
     # 前端传入的会话标识；唯一（避免重复创建）
     session_key: Mapped[str] = mapped_column(String(128), unique=True, index=True)
 
@@ -231,6 +277,8 @@ class ChatSession(Base):
     )
 
     user_id: Mapped[Optional[str]] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)
+    # 最后一条消息内容：非表字段，查询时通过 with_expression 填充（见 user_repo.get_chat_sessions），否则为 None
+    last_msg: Mapped[Optional[str]] = query_expression()
     # persona_id: Mapped[Optional[str]] = mapped_column(ForeignKey("personas.id", ondelete="SET NULL"), nullable=True, index=True)
 
     created_at: Mapped[datetime] = mapped_column(
@@ -268,7 +316,7 @@ class ChatSession(Base):
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=gen_uuid_str)
+    id: Mapped[str] = mapped_column(String(32), primary_key=True, default=gen_uuid_str)
     session_id: Mapped[str] = mapped_column(ForeignKey("chat_sessions.id", ondelete="CASCADE"), index=True)
 
     role: Mapped[str] = mapped_column(String(32))  # user / assistant / system / tool
@@ -293,11 +341,13 @@ class ChatMessage(Base):
     __table_args__ = (
         Index("ix_chat_messages_session_time", "session_id", "created_at"),
     )
+    # 插入时通过 RETURNING 一并取回服务端默认值（created_at），避免额外的 refresh 查询
+    __mapper_args__ = {"eager_defaults": True}
 
 class UserFile(Base):
     __tablename__ = "user_files"
 
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=gen_uuid_str)
+    id: Mapped[str] = mapped_column(String(32), primary_key=True, default=gen_uuid_str)
     user_id: Mapped[str] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)
     session_id: Mapped[Optional[str]] = mapped_column(ForeignKey("chat_sessions.id", ondelete="CASCADE"), index=True, nullable=True)
     
@@ -330,4 +380,10 @@ class UserFile(Base):
         Index("ix_user_files_user_session", "user_id", "session_id"),
         Index("ix_user_files_file_type", "file_type"),
         Index("ix_user_files_created_at", "created_at"),
+        # 按用户的时间倒序列表与键集分页（created_at, id）
+        Index("ix_user_files_user_created", "user_id", "created_at", "id"),
+        # 默认只列出活跃文件：等值过滤 (user_id, is_active) 后直接按 created_at 顺序（倒序扫描）读取，无需额外排序
+        Index("ix_user_files_user_active_created", "user_id", "is_active", "created_at"),
+        # 按类型筛选活跃文件、按类型统计
+        Index("ix_user_files_user_type_active", "user_id", "file_type", "is_active"),
     )
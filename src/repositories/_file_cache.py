@@ -0,0 +1,106 @@
+import copy
+import functools
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple, TypeVar
+
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.models import Base
+
+# 用户文件列表/统计的进程内TTL缓存：{(user_id, 函数名, 参数): (过期时间戳, 结果快照)}
+# 文件列表页与统计接口读多写少，缓存可省去重复的数据库往返；任何文件写操作都会按 user_id 使缓存失效。
+_TTL_SECONDS: float = 30.0
+_MAX_ENTRIES: int = 4096
+
+_cache: Dict[Tuple[Any, ...], Tuple[float, Any]] = {}
+# 每个用户的失效代数：加载期间若发生失效，加载结果不再写入缓存，避免旧数据回填
+_generations: Dict[str, int] = {}
+
+T = TypeVar("T")
+
+
+class _RowSnapshot:
+    """ORM 实例的快照：只保存模型类与列属性值，不持有实例本身"""
+    __slots__ = ("model", "values")
+
+    def __init__(self, row: Base):
+        self.model = type(row)
+        self.values = copy.deepcopy({attr.key: getattr(row, attr.key) for attr in inspect(self.model).column_attrs})
+
+
+def _snapshot(value: Any) -> Any:
+    """把查询结果转成缓存快照，缓存与返回给调用方的对象之间不共享任何可变状态"""
+    if isinstance(value, list):
+        return [_snapshot(v) for v in value]
+    if isinstance(value, Base):
+        return _RowSnapshot(value)
+    return copy.deepcopy(value)
+
+
+def _restore(snapshot: Any) -> Any:
+    """由快照重建一份全新的结果（ORM 实例重建为不属于任何会话的新实例）"""
+    if isinstance(snapshot, list):
+        return [_restore(v) for v in snapshot]
+    if isinstance(snapshot, _RowSnapshot):
+        return snapshot.model(**copy.deepcopy(snapshot.values))
+    return copy.deepcopy(snapshot)
+
+
+def cached_by_user(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """
+    为以 user_id 为第一个参数的仓储查询加TTL缓存。
+    传入 session（请求级会话/事务）时不走缓存，保证事务内读到自己的写入。
+    缓存中保存的是结果快照，每次命中都由快照重建新对象，调用方修改返回值（包括嵌套的 dict/ORM 实例）不会影响缓存。
+    """
+    @functools.wraps(func)
+    async def wrapper(user_id: str, *args: Any, session: Optional[AsyncSession] = None, **kwargs: Any) -> T:
+        if session is not None:
+            return await func(user_id, *args, session=session, **kwargs)
+
+        key = (user_id, func.__name__, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            return _restore(entry[1])
+
+        generation = _generations.get(user_id, 0)
+        result = await func(user_id, *args, **kwargs)
+
+        # 读取代数与写入缓存之间没有 await，单事件循环内无需加锁
+        if _generations.get(user_id, 0) == generation:
+            if len(_cache) >= _MAX_ENTRIES:
+                # 先清理过期项；仍然过多则整体清空，保证内存有界
+                for k in [k for k, (expiry, _) in _cache.items() if expiry <= now]:
+                    del _cache[k]
+                if len(_cache) >= _MAX_ENTRIES:
+                    _cache.clear()
+            _cache[key] = (time.monotonic() + _TTL_SECONDS, _snapshot(result))
+        return result
+
+    return wrapper
+
+
+def invalidate(user_ids: Iterable[Optional[str]]) -> None:
+    """文件被创建/更新/删除后，使相关用户的全部缓存条目失效"""
+    targets = {uid for uid in user_ids if uid}
+    if not targets:
+        return
+    for uid in targets:
+        _generations[uid] = _generations.get(uid, 0) + 1
+    for key in [k for k in _cache if k[0] in targets]:
+        _cache.pop(key, None)
+
+
+def invalidate_after_write(session: Optional[AsyncSession], user_ids: Iterable[Optional[str]]) -> None:
+    """
+    写操作后使缓存失效。
+    写入发生在调用方事务（传入 session）中时，提交前其他请求仍可能读到并缓存旧数据，
+    因此在该事务提交后再失效一次。
+    """
+    user_ids = list(user_ids)
+    invalidate(user_ids)
+    if session is not None:
+        event.listen(
+            session.sync_session, "after_commit", lambda _: invalidate(user_ids), once=True
+        )
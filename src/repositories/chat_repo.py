@@ -1,7 +1,8 @@
 from __future__ import annotations
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 
 from sqlalchemy import select, update
+from sqlalchemy.orm import load_only
 
 from src.db.db import db_manager
 from src.db.models import ChatSession, ChatMessage
@@ -10,7 +11,7 @@ async def get_or_create_session(
     session_key: str,
     user_id: Optional[str] = None,
     # persona_id: Optional[str] = None,
-) -> ChatSession:
+) -> Tuple[ChatSession, bool]:
     """
     获取或创建一个新的会话
     该函数用于根据session_key查找已存在的会话，如果不存在则创建一个新的会话。
@@ -21,7 +22,7 @@ async def get_or_create_session(
         user_id: 可选，用户标识符
         persona_id: 可选，用户画像标识符
     返回:
-        ChatSession: 返回会话对象，可能是新创建的或已存在的
+        Tuple[ChatSession, bool]: (会话对象, 是否为本次新创建)；新建会话必然没有历史消息
     """
     async with db_manager.session as session:
         result = await session.execute(
@@ -29,7 +30,8 @@ async def get_or_create_session(
         )
         row = result.scalar_one_or_none()
 
-        if row is None:
+        created = row is None
+        if created:
             row = ChatSession(
                 session_key=session_key,
                 user_id=user_id,
@@ -38,7 +40,7 @@ async def get_or_create_session(
             session.add(row)
             await session.commit()
             await session.refresh(row)
-        return row
+        return row, created
 
 
 async def add_message(
@@ -55,8 +57,8 @@ async def add_message(
     """
     异步添加一条消息到数据库的函数
 
-    该函数使用异步方式将消息记录添加到数据库中，包括提交事务和刷新对象。
-    使用了SessionLocal()作为会话管理，确保数据库连接的正确使用。
+    插入消息与更新会话 last_msg_id 在同一事务中完成，只提交一次；
+    created_at 由 INSERT ... RETURNING 直接带回（见 ChatMessage 的 eager_defaults），无需再 refresh。
 
     参数:
         session_pk: 会话ID
@@ -66,7 +68,7 @@ async def add_message(
     返回:
         ChatMessage: 包含所有添加信息的消息对象
     """
-    async with db_manager.session as session:
+    async with db_manager.session as session, session.begin():
         msg = ChatMessage(
             session_id=session_pk,
             role=role,
@@ -78,8 +80,7 @@ async def add_message(
             meta=meta,
         )
         session.add(msg)
-        await session.commit()
-        await session.refresh(msg)
+        await session.flush()  # msg.id 由客户端生成，flush 后即可使用
 
         # 更新会话的 last_msg_id
         await session.execute(
@@ -87,15 +88,49 @@ async def add_message(
             .where(ChatSession.id == session_pk)
             .values(last_msg_id=msg.id)
         )
-        await session.commit()
 
-        return msg
+    return msg
+
+
+async def add_messages(
+    session_pk: str,
+    rows: List[Dict[str, Any]],
+) -> List[ChatMessage]:
+    """
+    在同一事务中批量写入多条消息（例如一轮对话的 user + assistant），
+    只产生一次提交，并将会话的 last_msg_id 指向最后一条。
+
+    参数:
+        session_pk: 会话ID
+        rows: 消息字段字典列表，键同 add_message 的参数（role、content、name、input_tokens 等）
+
+    返回:
+        List[ChatMessage]: 按写入顺序排列的消息对象列表
+    """
+    if not rows:
+        return []
+    async with db_manager.session as session:
+        msgs = [ChatMessage(session_id=session_pk, **row) for row in rows]
+        session.add_all(msgs)
+        await session.flush()
+
+        # 更新会话的 last_msg_id
+        await session.execute(
+            update(ChatSession)
+            .where(ChatSession.id == session_pk)
+            .values(last_msg_id=msgs[-1].id)
+        )
+        await session.commit()
+        return msgs
 
 
 async def get_last_messages(session_pk: str, limit: int = 20) -> List[ChatMessage]:
 
     """
-    异步获取指定会话的最后几条消息记录
+    异步获取指定会话的最后几条消息记录（用于拼接“记忆”）
+
+    只加载 role、content、created_at 三列，跳过 metadata JSON 解码等无关列；
+    返回对象上的其他属性未加载，调用方不应访问。
 
     参数:
         session_pk: 会话的唯一标识符
@@ -107,6 +142,7 @@ async def get_last_messages(session_pk: str, limit: int = 20) -> List[ChatMessag
     async with db_manager.session as session:
         result = await session.execute(
             select(ChatMessage)
+            .options(load_only(ChatMessage.role, ChatMessage.content, ChatMessage.created_at))
             .where(ChatMessage.session_id == session_pk)
             .order_by(ChatMessage.created_at.desc())
             .limit(limit)
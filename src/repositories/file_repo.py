@@ -1,15 +1,36 @@
 from __future__ import annotations
-from typing import Optional, List, Dict, Any, Tuple
+import asyncio
+import json
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
 from datetime import datetime
 
-from sqlalchemy import select, update, and_, func, desc
-from sqlalchemy.orm import joinedload
+from sqlalchemy import select, insert, update, and_, func, desc, literal, tuple_, Text, String, ARRAY, any_, bindparam
+from sqlalchemy.orm import joinedload, aliased
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # from src.db.db import db_manager
 # from src.db.models import UserFile
 from ..db import db_manager, UserFile
+from ..db.db import session_scope, IS_SQLITE, IS_ASYNCPG
+from ..db.models import gen_uuid_str
 # from src.schemas.file import FileType, UserFileCreate, UserFileUpdate
 from ..schemas import FileType
+from ._file_cache import cached_by_user, invalidate_after_write
+
+async def _update_file_fields(file_id: str, session: Optional[AsyncSession], **values: Any) -> bool:
+    """
+    按ID更新单个文件的若干字段（UPDATE ... RETURNING，一次往返，不先 SELECT）
+    
+    返回:
+        bool: 文件存在并已更新则为True
+    """
+    stmt = update(UserFile).where(UserFile.id == file_id).values(**values).returning(UserFile.user_id)
+    async with session_scope(session) as s:
+        user_id = (await s.execute(stmt)).scalar_one_or_none()
+    invalidate_after_write(session, [user_id])
+    return user_id is not None
+
 
 async def create_user_file(
     user_id: str,
@@ -22,7 +43,8 @@ async def create_user_file(
     description: Optional[str] = None,
     meta: Optional[Dict[str, Any]] = None,
     version: int = 1,
-    is_active: bool = True
+    is_active: bool = True,
+    session: Optional[AsyncSession] = None
 ) -> UserFile:
     """
     创建用户文件记录
@@ -39,49 +61,97 @@ async def create_user_file(
         meta: 元数据（可选）
         version: 版本号（默认1）
         is_active: 是否活跃（默认True）
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         UserFile: 创建的文件对象
     """
-    async with db_manager.session as session:
-        user_file = UserFile(
-            user_id=user_id,
-            session_id=session_id,
-            file_url=file_url,
-            file_type=file_type,
-            file_name=file_name,
-            file_size=file_size,
-            mime_type=mime_type,
-            description=description,
-            meta=meta,
-            version=version,
-            is_active=is_active
-        )
-        session.add(user_file)
-        await session.commit()
-        await session.refresh(user_file)
-        return user_file
+    # INSERT ... RETURNING：一次往返写入并取回整行（含服务端生成的时间戳），无需 flush 后再 refresh
+    stmt = insert(UserFile).values(
+        user_id=user_id,
+        session_id=session_id,
+        file_url=file_url,
+        file_type=file_type,
+        file_name=file_name,
+        file_size=file_size,
+        mime_type=mime_type,
+        description=description,
+        meta=meta,
+        version=version,
+        is_active=is_active
+    ).returning(UserFile)
+    async with session_scope(session) as s:
+        user_file = (await s.execute(stmt)).scalar_one()
+    invalidate_after_write(session, [user_id])
+    return user_file
+
+
+async def create_user_files_bulk(
+    rows: List[Dict[str, Any]],
+    session: Optional[AsyncSession] = None
+) -> List[UserFile]:
+    """
+    批量创建用户文件记录（多文件上传等场景）
+    
+    参数:
+        rows: 文件记录字段字典列表，字段同 create_user_file 的参数
+        session: 可选，请求级会话（见 session_scope）
+    
+    返回:
+        List[UserFile]: 创建的文件对象列表，顺序与 rows 一致
+    """
+    if not rows:
+        return []
+    # 多行 INSERT ... RETURNING，按传入顺序返回
+    stmt = insert(UserFile).returning(UserFile, sort_by_parameter_order=True)
+    async with session_scope(session) as s:
+        user_files = list((await s.scalars(stmt, rows)).all())
+    invalidate_after_write(session, [row.get("user_id") for row in rows])
+    return user_files
 
 
-async def get_user_file(file_id: str) -> Optional[UserFile]:
+async def get_user_file(file_id: str, session: Optional[AsyncSession] = None) -> Optional[UserFile]:
     """
     根据文件ID获取文件
     
     参数:
         file_id: 文件ID
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         Optional[UserFile]: 文件对象，如果不存在则返回None
     """
-    async with db_manager.session as session:
-        return await session.get(UserFile, file_id)
+    async with session_scope(session) as s:
+        return await s.get(UserFile, file_id)
+
+
+async def get_file_owner_and_url(file_id: str, session: Optional[AsyncSession] = None) -> Optional[Row]:
+    """
+    只查询文件的归属用户、存储路径与内容摘要（权限校验、移动物理文件时使用），
+    内容摘要只从 meta 中取出 content_digest 一项；不加载 description 等较宽的列，也不构造 ORM 对象
+    
+    参数:
+        file_id: 文件ID
+        session: 可选，请求级会话（见 session_scope）
+    
+    返回:
+        Optional[Row]: 包含 user_id、file_url、content_digest（可能为None）的行，文件不存在则返回None
+    """
+    stmt = select(
+        UserFile.user_id,
+        UserFile.file_url,
+        UserFile.meta["content_digest"].as_string().label("content_digest"),
+    ).where(UserFile.id == file_id)
+    async with session_scope(session) as s:
+        return (await s.execute(stmt)).one_or_none()
 
 
 async def update_user_file(
     file_id: str,
     description: Optional[str] = None,
     is_active: Optional[bool] = None,
-    meta: Optional[Dict[str, Any]] = None
+    meta: Optional[Dict[str, Any]] = None,
+    session: Optional[AsyncSession] = None
 ) -> Optional[UserFile]:
     """
     更新文件信息
@@ -91,52 +161,50 @@ async def update_user_file(
         description: 新的文件描述（可选）
         is_active: 是否活跃（可选）
         meta: 新的元数据（可选）
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         Optional[UserFile]: 更新后的文件对象，如果文件不存在则返回None
     """
-    async with db_manager.session as session:
-        # 获取现有文件
-        user_file = await session.get(UserFile, file_id)
-        if not user_file:
-            return None
-        
-        # 更新字段
-        if description is not None:
-            user_file.description = description
-        if is_active is not None:
-            user_file.is_active = is_active
-        if meta is not None:
-            user_file.meta = meta
-        
-        await session.commit()
-        await session.refresh(user_file)
-        return user_file
+    # 只更新显式传入的字段
+    values: Dict[str, Any] = {}
+    if description is not None:
+        values["description"] = description
+    if is_active is not None:
+        values["is_active"] = is_active
+    if meta is not None:
+        values["meta"] = meta
+    if not values:
+        return await get_user_file(file_id, session=session)
 
+    # UPDATE ... RETURNING：一次往返完成更新并取回更新后的整行（含 updated_at）
+    stmt = update(UserFile).where(UserFile.id == file_id).values(**values).returning(UserFile)
+    async with session_scope(session) as s:
+        user_file = (await s.execute(stmt)).scalar_one_or_none()
+    if user_file is not None:
+        invalidate_after_write(session, [user_file.user_id])
+    return user_file
 
-async def delete_user_file(file_id: str) -> bool:
+
+async def delete_user_file(file_id: str, session: Optional[AsyncSession] = None) -> bool:
     """
     软删除文件（设置is_active为False）
     
     参数:
         file_id: 文件ID
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         bool: 删除是否成功
     """
-    async with db_manager.session as session:
-        user_file = await session.get(UserFile, file_id)
-        if not user_file:
-            return False
-        
-        user_file.is_active = False
-        await session.commit()
-        return True
+    return await _update_file_fields(file_id, session, is_active=False)
 
 
+@cached_by_user
 async def get_files_by_user_id(
     user_id: str,
-    include_inactive: bool = False
+    include_inactive: bool = False,
+    session: Optional[AsyncSession] = None
 ) -> List[UserFile]:
     """
     按用户ID查询文件
@@ -144,23 +212,57 @@ async def get_files_by_user_id(
     参数:
         user_id: 用户ID
         include_inactive: 是否包含非活跃文件（默认False）
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         List[UserFile]: 文件列表
     """
-    async with db_manager.session as session:
+    async with session_scope(session) as s:
         stmt = select(UserFile).where(UserFile.user_id == user_id)
         if not include_inactive:
             stmt = stmt.where(UserFile.is_active == True)
         stmt = stmt.order_by(desc(UserFile.created_at))
         
-        result = await session.execute(stmt)
+        result = await s.execute(stmt)
         return list(result.scalars().all())
 
 
+async def iter_files_by_user_id(
+    user_id: str,
+    include_inactive: bool = False,
+    batch_size: int = 200,
+    session: Optional[AsyncSession] = None
+) -> AsyncIterator[UserFile]:
+    """
+    按用户ID流式读取文件（导出、批量清理等需要遍历全部文件的场景）
+    通过服务端游标分批取行（yield_per），内存占用与文件总数无关；
+    需要完整列表的接口仍使用 get_files_by_user_id。
+    迭代结束（或提前 aclose）前会一直占用一个连接。
+    
+    参数:
+        user_id: 用户ID
+        include_inactive: 是否包含非活跃文件（默认False）
+        batch_size: 每批从游标取出的行数（默认200）
+        session: 可选，请求级会话（见 session_scope）
+    
+    返回:
+        AsyncIterator[UserFile]: 文件异步迭代器
+    """
+    stmt = select(UserFile).where(UserFile.user_id == user_id)
+    if not include_inactive:
+        stmt = stmt.where(UserFile.is_active == True)
+    stmt = stmt.order_by(desc(UserFile.created_at)).execution_options(yield_per=batch_size)
+    
+    async with session_scope(session) as s:
+        result = await s.stream_scalars(stmt)
+        async for user_file in result:
+            yield user_file
+
+
 async def get_files_by_session_id(
     session_id: str,
-    include_inactive: bool = False
+    include_inactive: bool = False,
+    session: Optional[AsyncSession] = None
 ) -> List[UserFile]:
     """
     按会话ID查询文件
@@ -168,24 +270,27 @@ async def get_files_by_session_id(
     参数:
         session_id: 会话ID
         include_inactive: 是否包含非活跃文件（默认False）
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         List[UserFile]: 文件列表
     """
-    async with db_manager.session as session:
+    async with session_scope(session) as s:
         stmt = select(UserFile).where(UserFile.session_id == session_id)
         if not include_inactive:
             stmt = stmt.where(UserFile.is_active == True)
         stmt = stmt.order_by(desc(UserFile.created_at))
         
-        result = await session.execute(stmt)
+        result = await s.execute(stmt)
         return list(result.scalars().all())
 
 
+@cached_by_user
 async def get_files_by_user_and_session(
     user_id: str,
     session_id: str,
-    include_inactive: bool = False
+    include_inactive: bool = False,
+    session: Optional[AsyncSession] = None
 ) -> List[UserFile]:
     """
     按用户和会话查询文件
@@ -194,11 +299,12 @@ async def get_files_by_user_and_session(
         user_id: 用户ID
         session_id: 会话ID
         include_inactive: 是否包含非活跃文件（默认False）
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         List[UserFile]: 文件列表
     """
-    async with db_manager.session as session:
+    async with session_scope(session) as s:
         stmt = select(UserFile).where(
             and_(
                 UserFile.user_id == user_id,
@@ -209,14 +315,16 @@ async def get_files_by_user_and_session(
             stmt = stmt.where(UserFile.is_active == True)
         stmt = stmt.order_by(desc(UserFile.created_at))
         
-        result = await session.execute(stmt)
+        result = await s.execute(stmt)
         return list(result.scalars().all())
 
 
+@cached_by_user
 async def get_files_by_type(
     user_id: str,
     file_type: FileType,
-    include_inactive: bool = False
+    include_inactive: bool = False,
+    session: Optional[AsyncSession] = None
 ) -> List[UserFile]:
     """
     按文件类型查询
@@ -225,11 +333,12 @@ async def get_files_by_type(
         user_id: 用户ID
         file_type: 文件类型
         include_inactive: 是否包含非活跃文件（默认False）
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         List[UserFile]: 文件列表
     """
-    async with db_manager.session as session:
+    async with session_scope(session) as s:
         stmt = select(UserFile).where(
             and_(
                 UserFile.user_id == user_id,
@@ -240,27 +349,29 @@ async def get_files_by_type(
             stmt = stmt.where(UserFile.is_active == True)
         stmt = stmt.order_by(desc(UserFile.created_at))
         
-        result = await session.execute(stmt)
+        result = await s.execute(stmt)
         return list(result.scalars().all())
 
 
-async def get_active_files(user_id: str) -> List[UserFile]:
+async def get_active_files(user_id: str, session: Optional[AsyncSession] = None) -> List[UserFile]:
     """
     查询用户的活跃文件
     
     参数:
         user_id: 用户ID
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         List[UserFile]: 活跃文件列表
     """
-    return await get_files_by_user_id(user_id, include_inactive=False)
+    return await get_files_by_user_id(user_id, include_inactive=False, session=session)
 
 
 async def create_file_version(
     original_file_id: str,
     new_file_url: str,
-    description: Optional[str] = None
+    description: Optional[str] = None,
+    session: Optional[AsyncSession] = None
 ) -> Optional[UserFile]:
     """
     创建文件新版本
@@ -269,151 +380,210 @@ async def create_file_version(
         original_file_id: 原始文件ID
         new_file_url: 新版本文件URL
         description: 新版本描述（可选）
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         Optional[UserFile]: 新版本文件对象，如果原始文件不存在则返回None
     """
-    async with db_manager.session as session:
-        # 获取原始文件
-        original_file = await session.get(UserFile, original_file_id)
-        if not original_file:
-            return None
-        
-        # 创建新版本
-        new_version = UserFile(
-            user_id=original_file.user_id,
-            session_id=original_file.session_id,
-            file_url=new_file_url,
-            file_type=original_file.file_type,
-            file_name=original_file.file_name,
-            file_size=original_file.file_size,
-            mime_type=original_file.mime_type,
-            description=description or original_file.description,
-            meta=original_file.meta,
-            version=original_file.version + 1,
-            is_active=True
-        )
-        
-        session.add(new_version)
-        await session.commit()
-        await session.refresh(new_version)
-        return new_version
-
-
-async def get_file_versions(file_id: str) -> List[UserFile]:
+    # INSERT ... SELECT ... RETURNING：新版本直接由原始文件行派生，一次往返完成读取、插入与取回；
+    # 原始文件不存在时 SELECT 为空，不插入任何行
+    source = select(
+        literal(gen_uuid_str()),
+        UserFile.user_id,
+        UserFile.session_id,
+        literal(new_file_url),
+        UserFile.file_type,
+        UserFile.file_name,
+        UserFile.file_size,
+        UserFile.mime_type,
+        func.coalesce(literal(description or None, Text), UserFile.description),
+        UserFile.meta,
+        UserFile.version + 1,
+        literal(True),
+    ).where(UserFile.id == original_file_id)
+    stmt = insert(UserFile).from_select(
+        [
+            UserFile.id,
+            UserFile.user_id,
+            UserFile.session_id,
+            UserFile.file_url,
+            UserFile.file_type,
+            UserFile.file_name,
+            UserFile.file_size,
+            UserFile.mime_type,
+            UserFile.description,
+            UserFile.meta,
+            UserFile.version,
+            UserFile.is_active,
+        ],
+        source,
+    ).returning(UserFile)
+    
+    async with session_scope(session) as s:
+        new_version = (await s.execute(stmt)).scalar_one_or_none()
+    if new_version is not None:
+        invalidate_after_write(session, [new_version.user_id])
+    return new_version
+
+
+async def get_file_versions(file_id: str, session: Optional[AsyncSession] = None) -> List[UserFile]:
     """
     获取文件的所有历史版本
     
     参数:
         file_id: 文件ID
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         List[UserFile]: 文件版本列表（按版本号降序排列）
     """
-    async with db_manager.session as session:
-        # 获取当前文件
-        current_file = await session.get(UserFile, file_id)
-        if not current_file:
-            return []
-        
-        # 查询相同用户、会话、文件名的所有版本
-        stmt = select(UserFile).where(
-            and_(
-                UserFile.user_id == current_file.user_id,
-                UserFile.session_id == current_file.session_id,
-                UserFile.file_name == current_file.file_name
-            )
-        ).order_by(desc(UserFile.version))
-        
-        result = await session.execute(stmt)
+    # 自连接：current 为当前文件，一次查询取出相同用户、会话、文件名的所有版本；
+    # 当前文件不存在时连接结果为空，等价于原先的提前返回
+    # session_id 可能为 NULL（个人文件），用 IS NOT DISTINCT FROM 做空值安全比较
+    current = aliased(UserFile)
+    stmt = select(UserFile).join(
+        current,
+        and_(
+            current.id == file_id,
+            UserFile.user_id == current.user_id,
+            UserFile.session_id.is_not_distinct_from(current.session_id),
+            UserFile.file_name == current.file_name
+        )
+    ).order_by(desc(UserFile.version))
+    
+    async with session_scope(session) as s:
+        result = await s.execute(stmt)
         return list(result.scalars().all())
 
 
-async def restore_user_file(file_id: str) -> bool:
+async def restore_user_file(file_id: str, session: Optional[AsyncSession] = None) -> bool:
     """
     恢复软删除的文件
     
     参数:
         file_id: 文件ID
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         bool: 恢复是否成功
     """
-    async with db_manager.session as session:
-        user_file = await session.get(UserFile, file_id)
-        if not user_file:
-            return False
-        
-        user_file.is_active = True
-        await session.commit()
-        return True
+    return await _update_file_fields(file_id, session, is_active=True)
 
 
-async def get_user_file_stats(user_id: str) -> Dict[str, Any]:
+@cached_by_user
+async def get_user_file_stats(user_id: str, session: Optional[AsyncSession] = None) -> Dict[str, Any]:
     """
     获取用户文件统计信息
     
     参数:
         user_id: 用户ID
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         Dict[str, Any]: 统计信息字典
     """
-    async with db_manager.session as session:
-        # 总文件数
-        total_stmt = select(func.count(UserFile.id)).where(UserFile.user_id == user_id)
-        total_result = await session.execute(total_stmt)
-        total_files = total_result.scalar_one()
-        
-        # 活跃文件数
-        active_stmt = select(func.count(UserFile.id)).where(
-            and_(
-                UserFile.user_id == user_id,
-                UserFile.is_active == True
-            )
-        )
-        active_result = await session.execute(active_stmt)
-        active_files = active_result.scalar_one()
-        
-        # 按文件类型统计
-        type_stmt = select(
-            UserFile.file_type,
-            func.count(UserFile.id).label('count')
-        ).where(
-            and_(
-                UserFile.user_id == user_id,
-                UserFile.is_active == True
-            )
-        ).group_by(UserFile.file_type)
-        
-        type_result = await session.execute(type_stmt)
-        type_stats = {row.file_type: row.count for row in type_result}
-        
-        # 总文件大小
-        size_stmt = select(func.sum(UserFile.file_size)).where(
-            and_(
-                UserFile.user_id == user_id,
-                UserFile.is_active == True
-            )
+    # 按文件类型分组，一条 SELECT 同时得到各类型的总数、活跃数与活跃文件大小，
+    # 总计在 Python 中汇总（分组数即文件类型数，很小），代替原来的 4 次往返
+    stmt = select(
+        UserFile.file_type,
+        func.count().label("total"),
+        func.count().filter(UserFile.is_active == True).label("active"),
+        func.sum(UserFile.file_size).filter(UserFile.is_active == True).label("size"),
+    ).where(UserFile.user_id == user_id).group_by(UserFile.file_type)
+
+    async with session_scope(session) as s:
+        rows = (await s.execute(stmt)).all()
+
+    total_files = sum(row.total for row in rows)
+    active_files = sum(row.active for row in rows)
+    total_size = sum(row.size or 0 for row in rows)
+    type_stats = {row.file_type: row.active for row in rows if row.active}
+
+    return {
+        "total_files": total_files,
+        "active_files": active_files,
+        "inactive_files": total_files - active_files,
+        "type_stats": type_stats,
+        "total_size_bytes": total_size,
+        "total_size_mb": round(total_size / (1024 * 1024), 2)
+    }
+
+
+# 列表排序：created_at 相同（秒级时间戳）时再按 id 排，保证顺序确定，键集分页才不会漏行或重复
+_KEYSET_ORDER = (desc(UserFile.created_at), desc(UserFile.id))
+
+
+def _keyset_created_at(value: datetime):
+    """
+    键集游标中的 created_at 绑定值。
+    SQLite 将 CURRENT_TIMESTAMP 存为 'YYYY-MM-DD HH:MM:SS' 文本，而 DateTime 绑定会带上微秒，
+    按文本比较时同一秒的行会被误判为更早；因此按存储格式绑定为字符串
+    """
+    if IS_SQLITE:
+        return literal(value.strftime("%Y-%m-%d %H:%M:%S"), String)
+    return literal(value, UserFile.created_at.type)
+
+
+async def get_files_after(
+    user_id: str,
+    after: Optional[Tuple[datetime, str]] = None,
+    page_size: int = 20,
+    include_inactive: bool = False,
+    session: Optional[AsyncSession] = None
+) -> Tuple[List[UserFile], Optional[Tuple[datetime, str]]]:
+    """
+    键集（seek）分页查询用户文件：按 (created_at, id) 从游标处继续向后取，
+    经 ix_user_files_user_created 索引直接定位，翻到多深都不必扫描并丢弃前面的行
+    
+    参数:
+        user_id: 用户ID
+        after: 上一页返回的游标 (created_at, id)；为空时取第一页
+        page_size: 每页大小
+        include_inactive: 是否包含非活跃文件（默认False）
+        session: 可选，请求级会话（见 session_scope）
+    
+    返回:
+        Tuple[List[UserFile], Optional[Tuple[datetime, str]]]: (文件列表, 下一页游标)，没有更多数据时游标为None
+    """
+    stmt = select(UserFile).where(UserFile.user_id == user_id)
+    if not include_inactive:
+        stmt = stmt.where(UserFile.is_active == True)
+    if after is not None:
+        created_at, file_id = after
+        stmt = stmt.where(
+            tuple_(UserFile.created_at, UserFile.id) < tuple_(_keyset_created_at(created_at), literal(file_id, String))
         )
-        size_result = await session.execute(size_stmt)
-        total_size = size_result.scalar_one() or 0
-        
-        return {
-            "total_files": total_files,
-            "active_files": active_files,
-            "inactive_files": total_files - active_files,
-            "type_stats": type_stats,
-            "total_size_bytes": total_size,
-            "total_size_mb": round(total_size / (1024 * 1024), 2)
-        }
+    stmt = stmt.order_by(*_KEYSET_ORDER).limit(page_size)
+    
+    async with session_scope(session) as s:
+        files = list((await s.execute(stmt)).scalars().all())
+    
+    next_cursor = (files[-1].created_at, files[-1].id) if len(files) == page_size else None
+    return files, next_cursor
+
+
+async def _estimate_row_count(session: AsyncSession, stmt) -> int:
+    """
+    PostgreSQL：通过 EXPLAIN (FORMAT JSON) 读取规划器估算的行数（Plan Rows），
+    代价与表大小无关，适合超大分页列表只需要大致总数的场景
+    """
+    conn = await session.connection()
+    compiled = stmt.compile(dialect=conn.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+    result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params)
+    plan = result.scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
 
 
 async def get_files_paginated(
     user_id: str,
     page: int = 1,
     page_size: int = 20,
-    include_inactive: bool = False
+    include_inactive: bool = False,
+    approximate: bool = False,
+    session: Optional[AsyncSession] = None
 ) -> Tuple[List[UserFile], int]:
     """
     分页查询用户文件
@@ -423,54 +593,106 @@ async def get_files_paginated(
         page: 页码（从1开始）
         page_size: 每页大小
         include_inactive: 是否包含非活跃文件（默认False）
+        approximate: 是否返回估算总数（仅 PostgreSQL 生效，取查询计划的估算行数，不扫描数据；其他数据库仍精确计数）
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         Tuple[List[UserFile], int]: (文件列表, 总记录数)
     """
-    async with db_manager.session as session:
-        # 基础查询
-        base_stmt = select(UserFile).where(UserFile.user_id == user_id)
-        if not include_inactive:
-            base_stmt = base_stmt.where(UserFile.is_active == True)
-        
-        # 计算总数
-        count_stmt = select(func.count()).select_from(base_stmt.subquery())
-        total_result = await session.execute(count_stmt)
-        total_count = total_result.scalar_one()
-        
-        # 分页查询
-        offset = (page - 1) * page_size
-        stmt = base_stmt.order_by(desc(UserFile.created_at)).offset(offset).limit(page_size)
-        
-        result = await session.execute(stmt)
-        files = list(result.scalars().all())
-        
+    conditions = [UserFile.user_id == user_id]
+    if not include_inactive:
+        conditions.append(UserFile.is_active == True)
+    
+    # 计算总数：COUNT(*) 直接作用于表，不再包一层子查询，也无需逐行判断列是否为 NULL
+    count_stmt = select(func.count()).select_from(UserFile).where(*conditions)
+    use_estimate = approximate and IS_ASYNCPG
+    
+    # 分页查询
+    offset = (page - 1) * page_size
+    stmt = select(UserFile).where(*conditions).order_by(*_KEYSET_ORDER).offset(offset).limit(page_size)
+
+    async def _count_on(s: AsyncSession) -> int:
+        if use_estimate:
+            return await _estimate_row_count(s, select(literal(1)).select_from(UserFile).where(*conditions))
+        return (await s.execute(count_stmt)).scalar_one()
+
+    if session is not None:
+        # 同一会话不能并发执行语句，沿用调用方会话时串行查询
+        total_count = await _count_on(session)
+        files = list((await session.execute(stmt)).scalars().all())
         return files, total_count
 
+    async def _count() -> int:
+        async with db_manager.session as s:
+            return await _count_on(s)
+
+    async def _page() -> List[UserFile]:
+        async with db_manager.session as s:
+            return list((await s.execute(stmt)).scalars().all())
+
+    # 总数与分页两条只读查询互不依赖，各取一个连接并发执行
+    total_count, files = await asyncio.gather(_count(), _page())
+    return files, total_count
+
+
+# 单条批量语句最多绑定的ID数：SQLite 对绑定参数个数有上限（默认 32766），
+# PostgreSQL 面对超长列表时规划开销也会随之增长，超出部分分块执行
+_BATCH_CHUNK_SIZE = 10000
 
-async def delete_files_batch(file_ids: List[str]) -> int:
+
+def _ids_filter(file_ids: List[str]):
+    """
+    按ID列表过滤的条件：
+    - asyncpg：WHERE id = ANY(:ids)，整个列表作为一个数组参数绑定
+    - 其他数据库：展开为 IN (...)
+    """
+    if IS_ASYNCPG:
+        return UserFile.id == any_(bindparam("ids", file_ids, type_=ARRAY(String)))
+    return UserFile.id.in_(file_ids)
+
+
+async def _update_files_by_ids(
+    file_ids: List[str],
+    values: Dict[str, Any],
+    session: Optional[AsyncSession]
+) -> int:
+    """按ID列表分块执行批量 UPDATE（同一事务内），返回实际更新的行数"""
+    file_ids = list(dict.fromkeys(file_ids))  # 去重并保持顺序
+    user_ids: List[str] = []
+    async with session_scope(session) as s:
+        for start in range(0, len(file_ids), _BATCH_CHUNK_SIZE):
+            chunk = file_ids[start:start + _BATCH_CHUNK_SIZE]
+            stmt = (
+                update(UserFile)
+                .where(_ids_filter(chunk))
+                .values(**values)
+                .returning(UserFile.user_id)
+                # 不同步会话中已加载的对象：批量操作只需行数与归属用户，省去对身份映射的逐行处理
+                .execution_options(synchronize_session=False)
+            )
+            user_ids.extend((await s.execute(stmt)).scalars().all())
+    invalidate_after_write(session, user_ids)
+    return len(user_ids)
+
+
+async def delete_files_batch(file_ids: List[str], session: Optional[AsyncSession] = None) -> int:
     """
     批量删除文件
     
     参数:
         file_ids: 文件ID列表
+        session: 可选，请求级会话（见 session_scope）
     
     返回:
         int: 成功删除的文件数量
     """
-    async with db_manager.session as session:
-        stmt = update(UserFile).where(
-            UserFile.id.in_(file_ids)
-        ).values(is_active=False)
-        
-        result = await session.execute(stmt)
-        await session.commit()
-        return result.rowcount
+    return await _update_files_by_ids(file_ids, {"is_active": False}, session)
 
 
 async def update_files_batch(
     file_ids: List[str],
-    updates: Dict[str, Any]
+    updates: Dict[str, Any],
+    session: Optional[AsyncSession] = None
 ) -> int:
     """
     批量更新文件
@@ -478,23 +700,19 @@ async def update_files_batch(
     参数:
         file_ids: 文件ID列表
         updates: 更新字段字典
+        session: 可选，请求级会话（见 session_scope）
 
     返回:
         int: 成功更新的文件数量
     """
-    async with db_manager.session as session:
-        stmt = update(UserFile).where(
-            UserFile.id.in_(file_ids)
-        ).values(**updates)
-
-        result = await session.execute(stmt)
-        await session.commit()
-        return result.rowcount
+    return await _update_files_by_ids(file_ids, updates, session)
 
 
+@cached_by_user
 async def get_personal_files(
     user_id: str,
-    include_inactive: bool = False
+    include_inactive: bool = False,
+    session: Optional[AsyncSession] = None
 ) -> List[UserFile]:
     """
     获取用户的个人文件（无session_id的文件）
@@ -502,11 +720,12 @@ async def get_personal_files(
     参数:
         user_id: 用户ID
         include_inactive: 是否包含非活跃文件（默认False）
+        session: 可选，请求级会话（见 session_scope）
 
     返回:
         List[UserFile]: 个人文件列表
     """
-    async with db_manager.session as session:
+    async with session_scope(session) as s:
         stmt = select(UserFile).where(
             and_(
                 UserFile.user_id == user_id,
@@ -517,39 +736,36 @@ async def get_personal_files(
             stmt = stmt.where(UserFile.is_active == True)
         stmt = stmt.order_by(desc(UserFile.created_at))
 
-        result = await session.execute(stmt)
+        result = await s.execute(stmt)
         return list(result.scalars().all())
 
 
-async def get_all_files() -> List[UserFile]:
+async def get_all_files(session: Optional[AsyncSession] = None) -> List[UserFile]:
     """
     获取所有文件记录
     
+    参数:
+        session: 可选，请求级会话（见 session_scope）
+    
     返回:
         List[UserFile]: 所有文件列表
     """
-    async with db_manager.session as session:
+    async with session_scope(session) as s:
         stmt = select(UserFile).order_by(desc(UserFile.created_at))
-        result = await session.execute(stmt)
+        result = await s.execute(stmt)
         return list(result.scalars().all())
 
 
-async def update_file_url(file_id: str, new_file_url: str) -> bool:
+async def update_file_url(file_id: str, new_file_url: str, session: Optional[AsyncSession] = None) -> bool:
     """
     更新文件的URL
     
     参数:
         file_id: 文件ID
         new_file_url: 新的文件URL
+        session: 可选，请求级会话（见 session_scope）
         
     返回:
         bool: 更新是否成功
     """
-    async with db_manager.session as session:
-        user_file = await session.get(UserFile, file_id)
-        if not user_file:
-            return False
-        
-        user_file.file_url = new_file_url
-        await session.commit()
-        return True
\ No newline at end of file
+    return await _update_file_fields(file_id, session, file_url=new_file_url)
\ No newline at end of file
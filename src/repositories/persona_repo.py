@@ -1,73 +1,122 @@
 from __future__ import annotations
 from typing import Optional, List
 
-from sqlalchemy import select
+from sqlalchemy import select, exists, update, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.db.db import db_manager
-from src.db.models import Persona
+from src.db.db import db_manager, session_scope
+from src.db.models import Persona, default_profile
 from src.schemas.profile import ProfileConfig
 
+# 热点查询的语句在模块加载时构建一次，调用时只绑定参数（聊天加载画像、画像增改时都会用到）
+_GET_BY_ID = select(Persona).where(Persona.id == bindparam("persona_id"))
+_GET_BY_USER = select(Persona).where(Persona.user_id == bindparam("user_id"))
+_GET_DEFAULT_BY_USER = (
+    select(Persona)
+    .where(Persona.user_id == bindparam("user_id"), Persona.is_default == True)
+    .limit(1)
+)
+_GET_PROFILE_BY_ID = select(Persona.profile).where(Persona.id == bindparam("persona_id"))
+_NAME_EXISTS = select(
+    exists().where(Persona.user_id == bindparam("user_id"), Persona.name == bindparam("name"))
+)
+
 async def create_persona(
     user_id: str,
     name: str,
     tags: Optional[str] = None,
-    profile: Optional[dict] = None,
+    profile: Optional[ProfileConfig] = None,
     is_default: bool = True,
+    session: Optional[AsyncSession] = None,
 ) -> Persona:
-    async with db_manager.session as session:
+    """
+    创建画像
+
+    参数:
+        session: 可选，外部事务会话；提供时不单独提交
+    """
+    async with session_scope(session) as s:
         persona = Persona(
             user_id=user_id,
             name=name,
             tags=tags,
-            profile=profile or ProfileConfig().model_dump(),
+            profile=profile or default_profile(),
             is_default=is_default,
         )
-        session.add(persona)
-        await session.commit()
-        await session.refresh(persona)
+        s.add(persona)
+        await s.flush()
+        await s.refresh(persona)
         return persona
 
 
 async def get_persona(user_id: str) -> List[Persona]:
     async with db_manager.session as session:
-        result = await session.execute(select(Persona).where(Persona.user_id == user_id))
+        result = await session.execute(_GET_BY_USER, {"user_id": user_id})
         return list(result.scalars().all())
 
-async def get_persona_pid(persona_id: str) -> Optional[Persona]:
+async def get_default_persona(user_id: str) -> Optional[Persona]:
+    """
+    获取用户的默认画像（经 ix_personas_user_default 索引只取一行，不加载该用户的全部画像）
+
+    参数:
+        user_id: 用户的唯一标识符
+
+    返回:
+        Optional[Persona]: 默认画像，没有则返回None
+    """
+    async with db_manager.session as session:
+        return (await session.execute(_GET_DEFAULT_BY_USER, {"user_id": user_id})).scalars().first()
+
+async def persona_name_exists(user_id: str, name: str, session: Optional[AsyncSession] = None) -> bool:
+    """
+    检查用户是否已有同名画像（EXISTS 查询，不加载画像行）
+
+    参数:
+        user_id: 用户的唯一标识符
+        name: 画像名称
+        session: 可选，请求级会话（见 session_scope）
+
+    返回:
+        bool: 已存在同名画像返回True
+    """
+    async with session_scope(session) as s:
+        return bool(await s.scalar(_NAME_EXISTS, {"user_id": user_id, "name": name}))
+
+async def get_persona_pid(persona_id: str, session: Optional[AsyncSession] = None) -> Optional[Persona]:
     """
     根据PersonID获取画像
     
     参数:
         persona_id: 画像的唯一标识符
+        session: 可选，请求级会话（见 session_scope）
         
     返回:
         Optional[Persona]: 如果找到则返回画像对象，否则返回None
     """
-    async with db_manager.session as session:
-        result = await session.execute(select(Persona).where(Persona.id == persona_id))
+    async with session_scope(session) as s:
+        result = await s.execute(_GET_BY_ID, {"persona_id": persona_id})
         return result.scalar_one_or_none()
 
-async def get_persona_profile(persona_id: str) -> Optional[str]:
+async def get_persona_profile(persona_id: str) -> Optional[ProfileConfig]:
     """
-    根据persona_id获取persona的内容
+    根据persona_id获取persona的结构化画像内容（只查询 profile 一列，不构造 Persona 对象）
 
     参数:
         persona_id: persona的唯一标识符
 
     返回:
-        Optional[str]: 如果找到则返回persona内容，否则返回None
+        Optional[ProfileConfig]: 如果找到则返回画像内容，否则返回None
     """
     async with db_manager.session as session:
-        result = await session.execute(select(Persona).where(Persona.id == persona_id))
-        obj = result.scalar_one_or_none()
-        return obj.content if obj else None
+        return await session.scalar(_GET_PROFILE_BY_ID, {"persona_id": persona_id})
     
 async def update_persona(
     persona_id: str,
     name: Optional[str] = None,
     tags: Optional[str] = None,
-    profile: Optional[dict] = None,
-    is_default: Optional[bool] = None
+    profile: Optional[ProfileConfig] = None,
+    is_default: Optional[bool] = None,
+    session: Optional[AsyncSession] = None,
 ) -> Optional[Persona]:
     """
     更新画像信息
@@ -78,13 +127,14 @@ async def update_persona(
         tags: 新的标签
         profile: 新的画像配置
         is_default: 是否为默认画像
+        session: 可选，外部事务会话；提供时不单独提交
         
     返回:
         Optional[Persona]: 更新后的画像对象，如果不存在则返回None
     """
-    async with db_manager.session as session:
+    async with session_scope(session) as s:
         # 获取现有画像
-        result = await session.execute(select(Persona).where(Persona.id == persona_id))
+        result = await s.execute(select(Persona).where(Persona.id == persona_id))
         persona = result.scalar_one_or_none()
         
         if not persona:
@@ -100,25 +150,28 @@ async def update_persona(
         if is_default is not None:
             persona.is_default = is_default
             
-        await session.commit()
-        await session.refresh(persona)
+        await s.flush()
+        await s.refresh(persona)
         return persona
 
-async def update_user_default_personas(user_id: str, is_default: bool) -> None:
+async def update_user_default_personas(
+    user_id: str,
+    is_default: bool,
+    session: Optional[AsyncSession] = None,
+) -> None:
     """
     更新用户的所有画像的默认状态
     
     参数:
         user_id: 用户的唯一标识符
         is_default: 要设置的默认状态
+        session: 可选，外部事务会话；提供时不单独提交
     """
-    async with db_manager.session as session:
-        # 获取用户的所有画像
-        result = await session.execute(select(Persona).where(Persona.user_id == user_id))
-        personas = result.scalars().all()
-        
-        # 更新所有画像的默认状态
-        for persona in personas:
-            persona.is_default = is_default
-            
-        await session.commit()
\ No newline at end of file
+    async with session_scope(session) as s:
+        # 单条 UPDATE，且只改动状态确实不同的行（取消默认时通常至多一行），
+        # 走 ix_personas_user_default 索引，不加载画像、也不刷新无关行的 updated_at
+        await s.execute(
+            update(Persona)
+            .where(Persona.user_id == user_id, Persona.is_default != is_default)
+            .values(is_default=is_default)
+        )
\ No newline at end of file
@@ -1,35 +1,84 @@
 from __future__ import annotations
-from typing import Optional, List
+from typing import Optional, List, Tuple, AsyncIterator
 from datetime import datetime, timezone
 
-from sqlalchemy import select, update
+from sqlalchemy import select, update, exists, literal, bindparam
+from sqlalchemy.orm import joinedload, with_expression
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.db.db import db_manager
+from src.db.db import db_manager, session_scope
 from src.db.models import User, ChatSession, ChatMessage
 from src.schemas.user import UserCreate, UserUpdate
 from src.utils.security import get_password_hash
 
-async def get_user(user_id: str) -> Optional[User]:
+# 热点查询的语句在模块加载时构建一次，调用时只绑定参数：
+# 省去每次调用重新构造 select() 与计算编译缓存键的开销（鉴权依赖每个请求都会按用户名查询）
+_GET_BY_EMAIL = select(User).where(User.email == bindparam("email"))
+_GET_BY_USERNAME = select(User).where(User.username == bindparam("username"))
+_GET_BY_USERNAME_WITH_PERSONAS = (
+    select(User)
+    .options(joinedload(User.personas))
+    .where(User.username == bindparam("username"))
+)
+
+async def get_user(user_id: str, session: Optional[AsyncSession] = None) -> Optional[User]:
     """根据ID获取用户"""
-    async with db_manager.session as session:
-        return await session.get(User, user_id) # session.get() 是 SQLAlchemy 的主键查询方法
+    async with session_scope(session) as s:
+        return await s.get(User, user_id) # session.get() 是 SQLAlchemy 的主键查询方法
 
 async def get_user_by_email(email: str) -> Optional[User]:
     """根据邮箱获取用户"""
     if not email:  # 添加空值检查
         return None
     async with db_manager.session as session:
-        stmt = select(User).where(User.email == email) # stmt是“statement”的缩写
-        return (await session.execute(stmt)).scalar_one_or_none()
+        return (await session.execute(_GET_BY_EMAIL, {"email": email})).scalar_one_or_none()
 
-async def get_user_by_username(username: str) -> Optional[User]:
+async def get_user_by_username(username: str, session: Optional[AsyncSession] = None) -> Optional[User]:
     """根据用户名获取用户"""
+    async with session_scope(session) as s:
+        return (await s.execute(_GET_BY_USERNAME, {"username": username})).scalar_one_or_none()
+
+async def get_user_by_username_with_personas(username: str) -> Optional[User]:
+    """根据用户名获取用户，并在同一查询中（LEFT JOIN）预加载其全部画像"""
     async with db_manager.session as session:
-        stmt = select(User).where(User.username == username)
-        return (await session.execute(stmt)).scalar_one_or_none()
+        result = await session.execute(_GET_BY_USERNAME_WITH_PERSONAS, {"username": username})
+        return result.unique().scalar_one_or_none()
+
+async def get_conflicts(
+    username: Optional[str],
+    email: Optional[str],
+    exclude_user_id: Optional[str] = None,
+    session: Optional[AsyncSession] = None,
+) -> Tuple[bool, bool]:
+    """
+    一次查询检查用户名、邮箱是否已被占用
+    参数:
+        username: 待检查的用户名，为空则不检查
+        email: 待检查的邮箱，为空则不检查
+        exclude_user_id: 可选，排除的用户ID（更新自身信息时使用）
+        session: 可选，请求级会话（见 session_scope）
+    返回:
+        Tuple[bool, bool]: (用户名已占用, 邮箱已占用)
+    """
+    if not username and not email:
+        return False, False
 
-async def create_user(user_in: UserCreate) -> User:
-    """创建新用户"""
+    def _taken(column, value):
+        if not value:
+            return literal(False)
+        conditions = [column == value]
+        if exclude_user_id:
+            conditions.append(User.id != exclude_user_id)
+        return exists().where(*conditions)
+
+    # 两个 EXISTS 在同一条 SELECT 中求值：一次往返，只返回两个布尔值，不加载任何用户行
+    stmt = select(_taken(User.username, username), _taken(User.email, email))
+    async with session_scope(session) as s:
+        username_taken, email_taken = (await s.execute(stmt)).one()
+    return bool(username_taken), bool(email_taken)
+
+async def create_user(user_in: UserCreate, session: Optional[AsyncSession] = None) -> User:
+    """创建新用户（传入 session 时不单独提交）"""
     hashed_password = get_password_hash(user_in.password)
     user = User(
         username=user_in.username,
@@ -38,45 +87,69 @@ async def create_user(user_in: UserCreate) -> User:
         hashed_password=hashed_password,
         last_login_at=datetime.now(timezone.utc)  # 使用UTC时间
     )
-    async with db_manager.session as session:
-        session.add(user)
-        await session.commit()
-        await session.refresh(user)
+    async with session_scope(session) as s:
+        s.add(user)
+        await s.flush()
+        await s.refresh(user)
         return user
 
-async def update_user(user_id: str, user_in: UserUpdate) -> Optional[User]:
-    """更新用户信息"""
+async def update_user(user_id: str, user_in: UserUpdate, session: Optional[AsyncSession] = None) -> Optional[User]:
+    """更新用户信息（传入 session 时不单独提交）"""
     update_data = user_in.model_dump(exclude_unset=True) #exclude_unset=True 参数：只包含那些明确设置了值的字段；排除那些使用默认值或未设置的字段
     if not update_data:
-        return await get_user(user_id) # 没有要更新的字段，直接返回当前用户
+        return await get_user(user_id, session=session) # 没有要更新的字段，直接返回当前用户
 
-    async with db_manager.session as session:
-        stmt = update(User).where(User.id == user_id).values(**update_data)
-        result = await session.execute(stmt)
-        if result.rowcount == 0:
-            return None # 用户不存在
-        await session.commit()
-    
-    return await get_user(user_id)
+    # UPDATE ... RETURNING：一次往返完成更新并取回更新后的用户（含服务端刷新的 updated_at）
+    stmt = update(User).where(User.id == user_id).values(**update_data).returning(User)
+    async with session_scope(session) as s:
+        return (await s.execute(stmt)).scalar_one_or_none() # 用户不存在时为None
+
+async def update_last_login(user_id: str, session: Optional[AsyncSession] = None) -> None:
+    """更新用户最后登录时间（传入 session 时不单独提交）"""
+    async with session_scope(session) as s:
+        stmt = (
+            update(User)
+            .where(User.id == user_id)
+            .values(last_login_at=datetime.now(timezone.utc))
+            # 不同步会话中已加载的 User：否则 onupdate 列会被过期，提交后访问将触发隐式 IO
+            .execution_options(synchronize_session=False)
+        )
+        await s.execute(stmt)
 
-async def update_last_login(user_id: str) -> None:
-    """更新用户最后登录时间"""
+async def update_password_hash(user_id: str, hashed_password: str) -> None:
+    """更新用户密码哈希（用于旧哈希算法升级）"""
     async with db_manager.session as session:
-        stmt = update(User).where(User.id == user_id).values(last_login_at=datetime.now(timezone.utc))
+        stmt = update(User).where(User.id == user_id).values(hashed_password=hashed_password)
         await session.execute(stmt)
         await session.commit()
 
 async def get_chat_sessions(user_id: str) -> List[ChatSession]:
     """获取用户所有对话"""
     async with db_manager.session as session:
+        # last_msg 在加载行时由 ORM 直接填充，无需逐行回写属性
         result = await session.execute(
-            select(ChatSession, ChatMessage.content)
+            select(ChatSession)
             .outerjoin(ChatMessage, ChatSession.last_msg_id == ChatMessage.id)
+            .options(with_expression(ChatSession.last_msg, ChatMessage.content))
             .where(ChatSession.user_id == user_id)
             .order_by(ChatSession.updated_at.desc())
         )
-        sessions = []
-        for session_row, last_msg in result:
-            session_row.last_msg = last_msg
-            sessions.append(session_row)
-        return sessions
\ No newline at end of file
+        return list(result.scalars().all())
+
+async def iter_chat_sessions(user_id: str, batch_size: int = 200) -> AsyncIterator[ChatSession]:
+    """
+    流式获取用户所有对话（与 get_chat_sessions 相同的查询，按 batch_size 分批从游标取行），
+    供需要遍历大量会话而不必一次性物化列表的场景使用
+    """
+    stmt = (
+        select(ChatSession)
+        .outerjoin(ChatMessage, ChatSession.last_msg_id == ChatMessage.id)
+        .options(with_expression(ChatSession.last_msg, ChatMessage.content))
+        .where(ChatSession.user_id == user_id)
+        .order_by(ChatSession.updated_at.desc())
+        .execution_options(yield_per=batch_size)
+    )
+    async with db_manager.session as session:
+        result = await session.stream_scalars(stmt)
+        async for chat_session in result:
+            yield chat_session
\ No newline at end of file
@@ -4,6 +4,9 @@ from typing import Optional
 from pydantic import BaseModel, field_validator
 
 
+# 会话ID格式：session_<时间戳>_<随机串>_<8位后缀>；模块加载时编译一次
+_SESSION_ID_RE = re.compile(r'^session_\d+_[a-z0-9]+_[A-Za-z0-9+/]{8}$')
+
 class ChatReq(BaseModel):
     instruction: str
     session_id: str = "default"
@@ -23,7 +26,6 @@ class ChatReq(BaseModel):
     def validate_session_id(cls, v):
         if not v:
             raise ValueError('Session ID is required')
-        pattern = r'^session_\d+_[a-z0-9]+_[A-Za-z0-9+/]{8}$'
-        if not re.match(pattern, v):
+        if not _SESSION_ID_RE.match(v):
             raise ValueError('Invalid session ID format')
         return v
\ No newline at end of file
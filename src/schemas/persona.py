@@ -1,20 +1,20 @@
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 from src.schemas.profile import ProfileConfig
 
 class PersonaCreate(BaseModel):
     name: str
     tags: Optional[str] = None
-    profile: Optional[Dict[str, Any]] = None
+    profile: Optional[ProfileConfig] = None  # 在请求解析阶段完成校验，非法画像返回 422
     is_default: bool = True
 
 class PersonaUpdate(BaseModel):
     name: Optional[str] = None
     tags: Optional[str] = None
-    profile: Optional[Dict[str, Any]] = None
+    profile: Optional[ProfileConfig] = None
     is_default: Optional[bool] = None
 
 class PersonaPublic(BaseModel):
@@ -27,5 +27,4 @@ class PersonaPublic(BaseModel):
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
@@ -3,7 +3,7 @@ from typing import List, Optional, Dict, Any
 
 from enum import Enum
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 class PreferredModality(str, Enum):
     VISUAL = "visual" 
@@ -60,7 +60,26 @@ class ContentLevel(str, Enum):
     K12_SAFE = "k12-safe"
     GENERAL_SAFE = "general-safe"
 
+# 可变默认值的模板：只在导入时构建一次，default_factory 中仅做浅层复制，
+# 避免每次实例化都重新求值字典/列表字面量
+_DEFAULT_GOALS: Dict[str, str] = {"short_term": "", "long_term": ""}
+_DEFAULT_STUDY_SCHEDULE: Dict[str, List[str]] = {
+    "Mon": ["19:00-20:00"],
+    "Sat": ["10:00-11:00"]
+}
+_DEFAULT_PROHIBITED_TOPICS: List[str] = ["Violent", "Adult"]
+
+def _default_study_schedule() -> Dict[str, List[str]]:
+    """复制默认时段表（内层列表同样复制，实例之间互不影响）"""
+    return {day: slots.copy() for day, slots in _DEFAULT_STUDY_SCHEDULE.items()}
+
+# 一经设置便不再修改的分组：冻结后跳过赋值时的 setattr 钩子，实例可安全地缓存/共享
+# 开启 use_enum_values 后枚举字段以字符串存取，默认值因此直接写成枚举的 value
+_IMMUTABLE_CONFIG = ConfigDict(frozen=True, extra="ignore", validate_assignment=False, use_enum_values=True)
+
 class IdentityConfig(BaseModel):
+    model_config = _IMMUTABLE_CONFIG
+
     nickname: str = Field(default="Sweetie", description="用户昵称")
     birth_month: str = Field(default="", description="出生月份")
     grade_level: str = Field(default="", description="年级")
@@ -73,7 +92,7 @@ class IdentityConfig(BaseModel):
 class LearningConfig(BaseModel):
     strengths: List[str] = Field(default_factory=list, description="学习优势")
     challenges: List[str] = Field(default_factory=list, description="学习挑战")
-    goals: Dict[str, str] = Field(default_factory=lambda: {"short_term": "", "long_term": ""})
+    goals: Dict[str, str] = Field(default_factory=_DEFAULT_GOALS.copy)
     subjects_focus: List[str] = Field(default_factory=list, description="关注的学科")
     preferred_modalities: List[PreferredModality] = Field(
         default_factory=list,
@@ -83,7 +102,8 @@ class LearningConfig(BaseModel):
         - kinesthetic（动觉型）：喜欢动手实践、操作等
         - reading（阅读型）：喜欢文字阅读
         - interactive（互动型）：喜欢讨论、问答等
-        """
+        """,
+        json_schema_extra={"uniqueItems": True},
     )
     pace: Pace = Field(default=Pace.NORMAL,description="学习节奏，慢、中、快")
     scaffolding_level: ScaffoldingLevel = Field(
@@ -99,6 +119,17 @@ class LearningConfig(BaseModel):
         description="纠错方式：socratic(提问引导)、direct(直接指正)、gentle(温和鼓励)、step_by_step(逐步分析)"
     )
 
+    @field_validator('preferred_modalities', mode='before')
+    @classmethod
+    def dedup_preferred_modalities(cls, v):
+        # 校验前先按原顺序去重，重复项不再逐个做枚举转换；含不可哈希元素时原样交给后续校验报错
+        if isinstance(v, list):
+            try:
+                return list(dict.fromkeys(v))
+            except TypeError:
+                return v
+        return v
+
 class MotivationConfig(BaseModel):
     tone: Tone = Field(default=Tone.ENCOURAGING, description="语气")
     praise_frequency: PraiseFrequency = Field(default=PraiseFrequency.MODERATE, description="表扬频率")
@@ -109,59 +140,44 @@ class MotivationConfig(BaseModel):
     reward_scheme: str = Field(default="", description="简单奖励规则（例：完成3题给1枚徽章）")
 
 class RoutinesConfig(BaseModel):
-    session_length_max: int = Field(default=60, description="单次最大会话时长（分钟）")
-    break_interval_min: int = Field(default=15, description="休息间隔（分钟）")
+    # 取值范围以 Field 约束声明，由 pydantic-core 直接校验
+    session_length_max: int = Field(default=60, ge=5, le=180, description="单次最大会话时长（分钟）")
+    break_interval_min: int = Field(default=15, ge=5, le=45, description="休息间隔（分钟）")
     study_schedule: Dict[str, List[str]] = Field(
-        default_factory=lambda: {
-            "Mon": ["19:00-20:00"],
-            "Sat": ["10:00-11:00"]
-        },
+        default_factory=_default_study_schedule,
         description="每周可用时段"
     )
     homework_policy: str = Field(default="Don't give direct answers, provide hints and key concepts", description="作业政策")
     offline_suggestions: bool = Field(default=True, description="在适当的时候提供这些离线学习建议，减少对AI的依赖")
 
-    @field_validator('session_length_max')
-    @classmethod
-    def validate_session_length(cls, v):
-        if not (5 <= v <= 180):
-            raise ValueError('session_length_max must be between 5 and 180 minutes')
-        return v
-
-    @field_validator('break_interval_min')
-    @classmethod
-    def validate_break_interval(cls, v):
-        if not (5 <= v <= 45):
-            raise ValueError('break_interval_min must be between 5 and 45 minutes')
-        return v
-
 class CommunicationConfig(BaseModel):
+    model_config = _IMMUTABLE_CONFIG
+
     emoji: bool = Field(default=True, description="是否使用表情符号")
     step_by_step: bool = Field(default=True, description="是否逐步讲解")
     ask_before_answer: bool = Field(default=True, description="是否在回答前提问")
 
 class AssessmentConfig(BaseModel):
-    quiz_style: QuizStyle = Field(default=QuizStyle.MULTIPLE_CHOICE, description="测验类型")
+    model_config = _IMMUTABLE_CONFIG
+
+    quiz_style: QuizStyle = Field(default=QuizStyle.MULTIPLE_CHOICE.value, description="测验类型")
     adapt_difficulty: bool = Field(default=True, description="根据学生的表现自动调整题目难度")
-    mastery_threshold: float = Field(default=0.8, description="掌握度阈值")
+    mastery_threshold: float = Field(default=0.8, ge=0.5, le=1.0, description="掌握度阈值")
     spaced_repetition: bool = Field(default=True, description="是否使用间隔重复，根据遗忘曲线，在适当的时间间隔重复练习")
 
-    @field_validator('mastery_threshold')
-    @classmethod
-    def validate_mastery_threshold(cls, v):
-        if not (0.5 <= v <= 1.0):
-            raise ValueError('mastery_threshold must be between 0.5 and 1.0')
-        return v
-
 class SafetyConfig(BaseModel):
+    model_config = _IMMUTABLE_CONFIG
+
     external_links_allowed: bool = Field(default=False, description="是否允许外部链接")
-    content_level: ContentLevel = Field(default=ContentLevel.K12_SAFE, description="内容等级")
+    content_level: ContentLevel = Field(default=ContentLevel.K12_SAFE.value, description="内容等级")
     prohibited_topics: List[str] = Field(
-        default_factory=lambda: ["Violent", "Adult"],
+        default_factory=_DEFAULT_PROHIBITED_TOPICS.copy,
         description="禁止的话题"
     )
 
 class MetaConfig(BaseModel):
+    model_config = _IMMUTABLE_CONFIG
+
     version: str = Field(default="1.0")
     notes: str = Field(default="")
 
@@ -175,10 +191,10 @@ class ProfileConfig(BaseModel):
     safety: SafetyConfig = Field(default_factory=SafetyConfig)
     meta: MetaConfig = Field(default_factory=MetaConfig)
 
-    class Config:
-        use_enum_values = True # 这个设置允许在序列化时使用枚举的实际值，而不是枚举对象本身。
-        arbitrary_types_allowed = True # 这个设置允许模型接受任意类型的字段
-        json_schema_extra = {
+    model_config = ConfigDict(
+        use_enum_values=True, # 这个设置允许在序列化时使用枚举的实际值，而不是枚举对象本身。
+        arbitrary_types_allowed=True, # 这个设置允许模型接受任意类型的字段
+        json_schema_extra={
             "example": {
                 "identity": {
                     "nickname": "小明",
@@ -189,4 +205,5 @@ class ProfileConfig(BaseModel):
                     "strengths": ["数学", "物理"]
                 }
             }
-        }
\ No newline at end of file
+        },
+    )
\ No newline at end of file
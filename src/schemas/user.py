@@ -1,20 +1,13 @@
-from pydantic import BaseModel, EmailStr, field_validator
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
 from typing import Optional
 from datetime import datetime
 
 # 基础用户模型
 class UserBase(BaseModel):
-    username: str
+    username: str = Field(min_length=6, max_length=30, description="用户名长度必须在6-30个字符之间")
     email: Optional[EmailStr] = None
     display_name: Optional[str] = None
 
-    @field_validator('username')
-    @classmethod
-    def validate_username(cls, v):
-        if v and (len(v) < 6 or len(v) > 30):
-            raise ValueError('用户名长度必须在6-30个字符之间')
-        return v
-
     # @field_validator('email', mode='before')
     # @classmethod
     # def set_email_from_username(cls, v, values):
@@ -41,16 +34,7 @@ class UserBase(BaseModel):
 
 # 创建用户时需要提供的模型
 class UserCreate(UserBase):
-    password: str
-
-    @field_validator('password')
-    @classmethod
-    def validate_password(cls, v):
-        if len(v) < 8:
-            raise ValueError("密码长度至少为8个字符")
-        if len(v) > 20:
-            raise ValueError("密码长度不能超过20个字符")
-        return v
+    password: str = Field(min_length=8, max_length=20, description="密码长度为8-20个字符")
     
 class UserLogin(BaseModel):
     username: str
@@ -69,8 +53,8 @@ class UserPublic(UserBase):
     updated_at: datetime
     last_login_at: Optional[datetime] = None
 
-    class Config:
-        from_attributes = True
+    # frozen：响应模型只读，实例创建后不再变更
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
     """
     from_attributes = True的作用：
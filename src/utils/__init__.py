@@ -14,6 +14,7 @@ from .file_utils import (
 from .security import (
     verify_password,
     get_password_hash,
+    password_needs_update,
     create_access_token,
     verify_token,
 )
@@ -31,6 +32,7 @@ __all__ = [
     "ensure_upload_directories",
     "verify_password",
     "get_password_hash",
+    "password_needs_update",
     "create_access_token",
     "verify_token",
 ]
\ No newline at end of file
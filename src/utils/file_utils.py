@@ -1,9 +1,14 @@
 import os
+import re
+import time
+import errno
+import hashlib
 import uuid
+import asyncio
 import shutil
+import threading
 from pathlib import Path
-from typing import Optional, Tuple
-from datetime import datetime
+from typing import Optional, Set, Tuple
 from fastapi import UploadFile, HTTPException, status
 
 from src.config.settings import settings
@@ -16,25 +21,120 @@ class FileUploadError(Exception):
     pass
 
 
+# 上传文件落盘时每次读写的块大小：峰值内存只与块大小有关，与文件大小无关
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class _FileTooLargeError(Exception):
+    """写入过程中发现文件超过大小上限"""
+    pass
+
+
+def _copy_upload_to_disk(src, dst: Path, max_size: int) -> Tuple[int, str]:
+    """
+    分块将上传内容写入磁盘（同步，在线程池中执行），边写边累计并校验大小，同时计算内容摘要
+    
+    返回:
+        Tuple[int, str]: (实际写入的字节数, 内容摘要)
+    """
+    file_size = 0
+    hasher = hashlib.blake2b(digest_size=16)
+    with dst.open("wb") as buffer:
+        while chunk := src.read(_COPY_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > max_size:
+                raise _FileTooLargeError()
+            hasher.update(chunk)
+            buffer.write(chunk)
+    return file_size, hasher.hexdigest()
+
+
+# 内容摘要格式（blake2b 16 字节的十六进制）；摘要来自数据库记录，拼接路径前先校验
+_CONTENT_DIGEST_RE = re.compile(r"[0-9a-f]{32}")
+# 按摘要分段加锁：同一内容的登记（上传）与释放（删除）串行执行，保证 st_nlink 的判断与随后的链接/删除之间不被并发操作打断
+_STORE_LOCKS = tuple(threading.Lock() for _ in range(64))
+
+
+def _store_lock(digest: str) -> threading.Lock:
+    return _STORE_LOCKS[int(digest[:8], 16) % len(_STORE_LOCKS)]
+
+
+def _link_to_content_store(path: Path, digest: str) -> None:
+    """
+    按内容摘要去重（同步）：
+    - 内容存储中尚无该摘要：把刚写入的文件硬链接登记进去
+    - 已有相同内容：用指向已有文件的硬链接原子替换刚写入的文件，两者共享同一份磁盘数据
+    文件系统不支持硬链接等失败情况下保留刚写入的文件，不影响上传
+    """
+    store_path = os.path.join(_CONTENT_STORE_DIR, digest)
+    link_path = f"{path}.link"
+    try:
+        _ensure_dir(_CONTENT_STORE_DIR)
+        with _store_lock(digest):
+            try:
+                os.link(path, store_path)
+                return
+            except FileExistsError:
+                pass
+            os.link(store_path, link_path)
+            os.replace(link_path, path)
+    except OSError as e:
+        logger.warning("文件内容去重失败，保留原文件: %s (%s)", path, e)
+        try:
+            os.unlink(link_path)
+        except OSError:
+            pass
+
+
+def _release_content_store(path: Path, digest: str) -> None:
+    """
+    用户文件即将被移除前调用（同步，调用方需持有该摘要的锁）：若该文件在内容存储中登记过，
+    且除存储条目外已没有其他用户文件引用同一份内容（st_nlink 将降为 1），则删除存储条目，
+    使磁盘空间可以随文件一起释放。只做 os.stat，不读取文件内容
+    """
+    store_path = os.path.join(_CONTENT_STORE_DIR, digest)
+    try:
+        store_stat = os.stat(store_path)
+    except FileNotFoundError:
+        return
+    file_stat = os.stat(path)
+    # 只处理确实与该文件共享 inode 的条目；nlink == 2 即只剩存储条目与这个文件本身
+    if (store_stat.st_dev, store_stat.st_ino) == (file_stat.st_dev, file_stat.st_ino) and store_stat.st_nlink <= 2:
+        os.unlink(store_path)
+
+
+def _store_upload(src, dst: Path, max_size: int) -> Tuple[int, str]:
+    """写入上传内容并按内容去重（同步，在线程池中执行），返回 (文件大小, 内容摘要)"""
+    file_size, digest = _copy_upload_to_disk(src, dst, max_size)
+    _link_to_content_store(dst, digest)
+    return file_size, digest
+
+
+# MIME类型 -> 文件类型 的分派表，模块加载时构建一次
+_MIME_PREFIX_TYPES = {
+    'image': FileType.IMAGE,
+    'audio': FileType.AUDIO,
+    'video': FileType.VIDEO,
+}
+_MIME_EXACT_TYPES = {
+    'application/pdf': FileType.DOCUMENT,
+    'text/plain': FileType.DOCUMENT,
+    'application/msword': FileType.DOCUMENT,
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': FileType.DOCUMENT,
+}
+
+
 def get_file_type_from_mime(mime_type: str) -> FileType:
     """根据MIME类型获取文件类型枚举"""
-    if mime_type.startswith('image/'):
-        return FileType.IMAGE
-    elif mime_type.startswith('audio/'):
-        return FileType.AUDIO
-    elif mime_type.startswith('video/'):
-        return FileType.VIDEO
-    elif mime_type in ['application/pdf', 'text/plain', 'application/msword', 
-                      'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-        return FileType.DOCUMENT
-    else:
-        return FileType.OTHER
+    # 先按主类型（'/' 之前的部分）查表，再按完整MIME类型查表
+    file_type = _MIME_PREFIX_TYPES.get(mime_type.partition('/')[0]) if '/' in mime_type else None
+    return file_type or _MIME_EXACT_TYPES.get(mime_type, FileType.OTHER)
 
 
 def validate_file(file: UploadFile) -> None:
     """验证上传的文件"""
-    # 检查文件大小
-    if file.size > settings.MAX_FILE_SIZE:
+    # 检查文件大小（客户端声明的大小可能缺失或不准确，仅用于提前拒绝；实际大小在写入时逐块校验）
+    if file.size is not None and file.size > settings.MAX_FILE_SIZE:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail=f"文件大小不能超过 {settings.MAX_FILE_SIZE // (1024 * 1024)}MB"
@@ -48,39 +148,67 @@ def validate_file(file: UploadFile) -> None:
         )
 
 
+# 文件名中需要移除的字符：除字母数字（含Unicode，与 str.isalnum 一致）、下划线、连字符、空格之外的全部字符
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^\w\- ]")
+
+
 def sanitize_filename(filename: str) -> str:
     """清理文件名，移除不安全字符"""
     # 保留文件扩展名
     name, ext = os.path.splitext(filename)
     # 只保留字母、数字、下划线、连字符和点号
-    safe_name = "".join(c for c in name if c.isalnum() or c in ('_', '-', ' '))
+    safe_name = _UNSAFE_FILENAME_CHARS.sub("", name)
     safe_name = safe_name.replace(' ', '_')  # 将空格替换为下划线
     return f"{safe_name}{ext}"
 
 
+# 本进程已确保存在的目录：同一用户/会话的后续上传无需再 stat/mkdir
+# 目录若在进程运行期间被外部删除需重启进程
+_ensured_dirs: Set[str] = set()
+# _ensure_dir 既在事件循环线程中调用，也在 asyncio.to_thread 的工作线程中调用（_store_upload、_move_to_temp）
+_ensured_dirs_lock = threading.Lock()
+
+
+def _ensure_dir(directory: str) -> None:
+    """确保目录存在，每个目录在进程内只 mkdir 一次"""
+    if directory in _ensured_dirs:
+        return
+    with _ensured_dirs_lock:
+        if directory not in _ensured_dirs:
+            os.makedirs(directory, exist_ok=True)
+            _ensured_dirs.add(directory)
+
+
+# 上传根目录在运行期间不变；路径拼接用 os.path 字符串操作，最后只构造一个 Path
+_UPLOAD_DIR_STR = str(settings.UPLOAD_DIR)
+# 内容存储：以内容摘要命名的硬链接，重复上传的相同内容只占用一份磁盘空间；
+# 位于 static 之外，不能通过 /static 按摘要直接访问
+_CONTENT_STORE_DIR = str(settings.CONTENT_STORE_DIR)
+
+
 def get_user_file_path(user_id: str, session_id: Optional[str], filename: str) -> Path:
     """获取用户文件的存储路径，确保目录存在"""
-    upload_dir = Path(settings.UPLOAD_DIR)
-    
-    if session_id:
-        # 有会话ID：存储在会话目录中
-        user_dir = upload_dir / user_id / session_id
-    else:
-        # 无会话ID：存储在用户个人文件目录中
-        user_dir = upload_dir / user_id / "personal"
+    # 有会话ID：存储在会话目录中；无会话ID：存储在用户个人文件目录中
+    user_dir = os.path.join(_UPLOAD_DIR_STR, user_id, session_id or "personal")
     
     # 确保目录存在
-    user_dir.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(user_dir)
     
-    return user_dir / filename
+    return Path(os.path.join(user_dir, filename))
 
 
 async def save_uploaded_file(
     file: UploadFile,
     user_id: str,
     session_id: Optional[str] = None
-) -> Tuple[str, str, int, FileType]:
-    """保存上传的文件并返回文件信息"""
+) -> Tuple[str, str, int, FileType, str]:
+    """
+    保存上传的文件并返回文件信息
+    
+    返回:
+        Tuple[str, str, int, FileType, str]: (存储路径, 原始文件名, 文件大小, 文件类型, 内容摘要)；
+        内容摘要需随文件记录保存（meta["content_digest"]），删除文件时据此释放内容存储条目
+    """
     
     # 验证文件
     validate_file(file)
@@ -90,29 +218,31 @@ async def save_uploaded_file(
     safe_filename = sanitize_filename(file.filename)
     stored_filename = f"{file_id}_{safe_filename}"
     
-    # 获取存储路径
+    # 获取存储路径（get_user_file_path 已确保目录存在）
     file_path = get_user_file_path(user_id, session_id, stored_filename)
     
-    # 确保目录存在
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    
     try:
-        # 保存文件
-        with file_path.open("wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # 获取文件大小
-        file_size = len(content)
+        # 分块流式保存文件并按内容去重，整个过程只切换一次线程，不阻塞事件循环，也不把整个文件读入内存
+        await file.seek(0)
+        file_size, content_digest = await asyncio.to_thread(
+            _store_upload, file.file, file_path, settings.MAX_FILE_SIZE
+        )
         
         # 获取文件类型
         file_type = get_file_type_from_mime(file.content_type)
         
-        logger.info(f"文件上传成功: user_id={user_id}, session_id={session_id}, "
-                   f"filename={file.filename}, size={file_size}, type={file_type}")
+        logger.info("文件上传成功: user_id=%s, session_id=%s, filename=%s, size=%s, type=%s",
+                    user_id, session_id, file.filename, file_size, file_type)
         
-        return str(file_path), file.filename, file_size, file_type
+        return str(file_path), file.filename, file_size, file_type, content_digest
         
+    except _FileTooLargeError:
+        logger.warning("文件超过大小上限，已拒绝: user_id=%s, filename=%s", user_id, file.filename)
+        file_path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"文件大小不能超过 {settings.MAX_FILE_SIZE // (1024 * 1024)}MB"
+        )
     except Exception as e:
         logger.error(f"文件保存失败: {str(e)}")
         # 如果文件已部分写入，尝试删除
@@ -136,23 +266,56 @@ def get_file_download_url(file_path: str) -> str:
     return f"/{normalized_path}"
 
 
-async def delete_user_file(file_path: str) -> bool:
-    """删除用户文件，移动到temp文件夹"""
+def _move_to_temp(path: Path, content_digest: Optional[str] = None) -> Path:
+    """将用户文件移到temp文件夹，并释放不再被引用的内容存储条目（同步，在线程池中执行）"""
+    # 创建temp目录路径（放在项目根目录下，不在static目录中）
+    temp_dir = Path("temp_deleted_files")
+    _ensure_dir(str(temp_dir))
+    
+    # 生成temp目录中的新文件名（保持原文件名，加纳秒时间戳前缀，同一秒内的并发删除也不会冲突）
+    temp_filename = f"{time.time_ns()}_{path.name}"
+    temp_path = temp_dir / temp_filename
+    
+    if content_digest and _CONTENT_DIGEST_RE.fullmatch(content_digest):
+        # 同一内容的并发删除/上传串行执行：释放判断与随后的移动/删除之间链接数不会被改变
+        with _store_lock(content_digest):
+            _release_content_store(path, content_digest)
+            _move_file(path, temp_path)
+    else:
+        _move_file(path, temp_path)
+    return temp_path
+
+
+def _move_file(path: Path, temp_path: Path) -> None:
+    """移动单个文件到temp目录（同步）"""
+    if os.stat(path).st_nlink > 1:
+        # 内容仍被其他用户文件/存储条目共享：temp 中保存独立副本，避免 temp 文件继续占用共享 inode 的链接计数
+        shutil.copy2(path, temp_path)
+        os.unlink(path)
+        return
+    
+    # 移动文件到temp目录：同一文件系统内直接原子重命名；跨文件系统时退回 shutil.move（复制后删除）
+    try:
+        os.replace(path, temp_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(str(path), str(temp_path))
+
+
+async def delete_user_file(file_path: str, content_digest: Optional[str] = None) -> bool:
+    """
+    删除用户文件，移动到temp文件夹
+    
+    参数:
+        file_path: 文件存储路径
+        content_digest: 上传时记录的内容摘要（见 save_uploaded_file）；提供时顺带释放不再被引用的内容存储条目
+    """
     try:
         path = Path(file_path)
         if path.exists():
-            # 创建temp目录路径（放在项目根目录下，不在static目录中）
-            temp_dir = Path("temp_deleted_files")
-            temp_dir.mkdir(exist_ok=True)
-            
-            # 生成temp目录中的新文件名（保持原文件名但添加时间戳避免冲突）
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            temp_filename = f"{timestamp}_{path.name}"
-            temp_path = temp_dir / temp_filename
-            
-            # 移动文件到temp目录
-            shutil.move(str(path), str(temp_path))
-            logger.info(f"文件已移动到temp文件夹: {file_path} -> {temp_path}")
+            temp_path = await asyncio.to_thread(_move_to_temp, path, content_digest)
+            logger.info("文件已移动到temp文件夹: %s -> %s", file_path, temp_path)
             return True
         return False
     except Exception as e:
@@ -164,6 +327,6 @@ def ensure_upload_directories():
     """确保上传目录存在"""
     upload_dir = Path(settings.UPLOAD_DIR)
     
-    upload_dir.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(str(upload_dir))
     
-    logger.info(f"上传目录已确保存在: {upload_dir}")
+    logger.info("上传目录已确保存在: %s", upload_dir)
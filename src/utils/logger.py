@@ -1,21 +1,32 @@
+import atexit
 import logging
 import logging.handlers
 import os
+import queue
+import threading
 from pathlib import Path
 
 class Logger:
     _instance = None
     _initialized = False
+    # 保护单例创建与一次性配置，避免多线程同时初始化时重复注册处理器（日志重复输出）
+    _lock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
         return cls._instance
 
     def __init__(self):
-        if not Logger._initialized:
-            self._setup_logger()
-            Logger._initialized = True
+        # 已初始化时直接返回，常规路径不加锁
+        if Logger._initialized:
+            return
+        with Logger._lock:
+            if not Logger._initialized:
+                self._setup_logger()
+                Logger._initialized = True
 
     def _setup_logger(
             self,
@@ -52,16 +63,15 @@ class Logger:
         if self.logger.handlers:
             return
 
-        # 创建日志格式
+        # 创建日志格式（funcName 为实际调用方，由各方法的 stacklevel 定位）
         formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            '%(asctime)s - %(name)s - %(levelname)s - [%(funcName)s] %(message)s'
         )
 
         # 控制台处理器
         console_handler = logging.StreamHandler()
         console_handler.setLevel(log_level)
         console_handler.setFormatter(formatter)
-        self.logger.addHandler(console_handler)
 
         # 文件处理器（使用RotatingFileHandler实现日志轮转）
         log_path = os.path.join(log_dir, log_file)
@@ -73,59 +83,49 @@ class Logger:
         )
         file_handler.setLevel(log_level)
         file_handler.setFormatter(formatter)
-        self.logger.addHandler(file_handler)
-
-    def _get_caller(self) -> str:
-        """获取调用者的函数名称和参数"""
-        import inspect
-        frame = inspect.currentframe()
-        try:
-            # 回溯两帧以获取实际的调用者
-            caller_frame = frame.f_back.f_back
-            # 获取函数名
-            func_name = caller_frame.f_code.co_name
-            # 获取参数信息
-            args_info = inspect.getargvalues(caller_frame)
-            # 格式化参数
-            args = []
-            for arg in args_info.args:
-                args.append(f"{arg}={args_info.locals[arg]}")
-            if args_info.varargs:
-                args.append(f"*{args_info.varargs}={args_info.locals[args_info.varargs]}")
-            if args_info.keywords:
-                args.append(f"**{args_info.keywords}={args_info.locals[args_info.keywords]}")
-
-            return f"{func_name}({', '.join(args)})"
-        finally:
-            del frame
-
-    def debug(self, message: str):
+
+        # 调用方只把日志记录放入队列，格式化与控制台/文件写入由后台监听线程完成，
+        # 请求路径不再被磁盘 I/O 阻塞；进程退出时停止监听线程，确保队列中的日志写完
+        log_queue = queue.SimpleQueue()
+        self.logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self._listener = logging.handlers.QueueListener(
+            log_queue, console_handler, file_handler, respect_handler_level=True
+        )
+        self._listener.start()
+        atexit.register(self._listener.stop)
+
+    # 各方法支持 %-风格的延迟格式化：logger.info("user_id=%s", user_id)
+    # 级别未启用时直接返回，参数不会被转成字符串
+
+    def debug(self, message: str, *args):
         """记录调试信息"""
-        self.logger.debug(message)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(message, *args, stacklevel=2)
 
-    def info(self, message: str):
+    def info(self, message: str, *args):
         """记录一般信息"""
-        self.logger.info(message)
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(message, *args, stacklevel=2)
 
-    def warning(self, message: str):
+    def warning(self, message: str, *args):
         """记录警告信息"""
-        self.logger.warning(message)
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.logger.warning(message, *args, stacklevel=2)
 
-    def error(self, message: str, exc_info=False):
+    def error(self, message: str, *args, exc_info=False):
         """记录错误信息"""
-        caller_info = self._get_caller()  # caller 函数名、参数
-        if exc_info:
-            self.logger.error(f"[{caller_info}] {message}", exc_info=True)
-        else:
-            self.logger.error(f"[{caller_info}] {message}")
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.logger.error(message, *args, exc_info=exc_info, stacklevel=2)
 
-    def critical(self, message: str):
+    def critical(self, message: str, *args):
         """记录严重错误信息"""
-        self.logger.critical(message)
+        if self.logger.isEnabledFor(logging.CRITICAL):
+            self.logger.critical(message, *args, stacklevel=2)
 
-    def exception(self, message: str):
+    def exception(self, message: str, *args):
         """记录异常信息（包含堆栈跟踪）"""
-        self.logger.exception(message)
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.logger.exception(message, *args, stacklevel=2)
 
 
 # 创建单例实例
@@ -1,28 +1,61 @@
-from typing import Optional
+import threading
+import time
+from typing import Dict, Optional, Tuple
 from datetime import datetime, timedelta, timezone
-from jose import jwt  # 导入JWT处理模块
+import jwt  # PyJWT：HMAC 签名走 hashlib/OpenSSL
 from passlib.context import CryptContext
 from fastapi import HTTPException
 from src.config.settings import settings
 
-# 使用 bcrypt 算法
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 新密码使用 argon2id；旧的 bcrypt 哈希仍可验证，并在登录成功后升级（needs_update）
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__time_cost=settings.ARGON2_TIME_COST,
+    argon2__memory_cost=settings.ARGON2_MEMORY_COST,
+    argon2__parallelism=settings.ARGON2_PARALLELISM,
+)
 
 # JWT 配置
 SECRET_KEY = settings.SECRET_KEY # JWT签名密钥
 ALGORITHM = "HS256"  # JWT签名算法
+_SIGNING_KEY = SECRET_KEY.encode("utf-8")  # 预先编码，避免每次签名/验签都转换一次
+_ALGORITHMS = [ALGORITHM]
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES  # token有效期（分钟）
 
+# 已验证令牌缓存：{token: (缓存失效时间戳, 用户名)}
+# 同一客户端的连续请求（轮询、突发）反复携带同一 token，命中时免去 HMAC 验签与 JSON 解码。
+# 失效时间取 TTL 与 token 自身 exp 的较小者，过期 token 永远不会从缓存中被放行。
+_TOKEN_CACHE_TTL_SECONDS: float = 60.0
+_TOKEN_CACHE_MAX_ENTRIES: int = 4096
+_token_cache: Dict[str, Tuple[float, str]] = {}
+_token_cache_lock = threading.Lock()  # verify_token 为同步函数，可能在线程池中被调用
+
+# 历史上密码先截断到 72 字节（bcrypt 上限）再哈希，新旧哈希都依赖这一规则，必须保持
+_MAX_PASSWORD_BYTES = 72
+
+def _password_bytes(password: str) -> bytes:
+    """
+    将密码编码为参与哈希的字节串（passlib 直接接受 bytes，省去再解码回 str）
+    超过72字节时截断；若截断落在多字节字符中间，丢弃残缺字节，与原先的 decode(errors='ignore') 结果一致
+    """
+    encoded = password.encode('utf-8')
+    if len(encoded) <= _MAX_PASSWORD_BYTES:
+        return encoded
+    return encoded[:_MAX_PASSWORD_BYTES].decode('utf-8', errors='ignore').encode('utf-8')
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """验证明文密码和哈希密码是否匹配"""
-    truncated_password = plain_password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
-    return pwd_context.verify(truncated_password, hashed_password)
+    return pwd_context.verify(_password_bytes(plain_password), hashed_password)
 
 def get_password_hash(password: str) -> str:
     """生成密码的哈希值"""
-    # 截断密码至72字节以内
-    truncated_password = password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
-    return pwd_context.hash(truncated_password)
+    return pwd_context.hash(_password_bytes(password))
+
+def password_needs_update(hashed_password: str) -> bool:
+    """哈希是否使用了已弃用的算法或过时的成本参数，需要重新哈希"""
+    return pwd_context.needs_update(hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """创建访问令牌"""
@@ -32,18 +65,41 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:  # 使用默认过期时间
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})  # 添加过期时间到数据中
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)  # 创建JWT
+    encoded_jwt = jwt.encode(to_encode, _SIGNING_KEY, algorithm=ALGORITHM)  # 创建JWT
     return encoded_jwt
 
+def _cache_token(token: str, username: str, exp: Optional[float], now: float) -> None:
+    """将验证通过的令牌写入缓存，超出上限时先清理过期项，仍然过多则整体清空"""
+    expiry = now + _TOKEN_CACHE_TTL_SECONDS
+    if exp is not None:
+        expiry = min(expiry, float(exp))
+    with _token_cache_lock:
+        if len(_token_cache) >= _TOKEN_CACHE_MAX_ENTRIES:
+            for k in [k for k, (until, _) in _token_cache.items() if until <= now]:
+                del _token_cache[k]
+            if len(_token_cache) >= _TOKEN_CACHE_MAX_ENTRIES:
+                _token_cache.clear()
+        _token_cache[token] = (expiry, username)
+
 def verify_token(token: str) -> Optional[str]:
-    """验证令牌并返回用户名"""
+    """验证令牌并返回用户名（验证结果带短期缓存）"""
+    now = time.time()
+    entry = _token_cache.get(token)
+    if entry is not None:
+        if entry[0] > now:
+            return entry[1]
+        # 缓存已到期：丢弃后重新解码，由 jwt.decode 判定 token 是否已过期
+        with _token_cache_lock:
+            _token_cache.pop(token, None)
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])  # 解码JWT
+        payload = jwt.decode(token, _SIGNING_KEY, algorithms=_ALGORITHMS)  # 解码JWT
         username: str = payload.get("sub")  # 获取用户名
         if username is None:
             return None
+        _cache_token(token, username, payload.get("exp"), now)
         return username
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token已过期")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="无效的Token")
\ No newline at end of file
@@ -370,6 +370,8 @@ document.addEventListener('DOMContentLoaded', () => {
                                         Prism.highlightElement(block);
                                     });
                                 }
+                            } else if (jsonObj.error) {
+                                showError(jsonObj.error);
                             } else if (jsonObj.input_tokens !== undefined && jsonObj.time !== undefined) {
                                 const elapsedTime = parseFloat(jsonObj.time).toFixed(2);
 
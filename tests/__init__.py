@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# 测试使用独立的临时 SQLite 数据库；必须在导入 src 之前设置
+os.environ.setdefault("API_KEY", "test")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/test.db")
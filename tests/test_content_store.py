@@ -0,0 +1,89 @@
+import io
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src.utils import file_utils
+
+
+class ContentStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self.root = Path(tempfile.mkdtemp())
+        os.chdir(self.root)
+        self.store = self.root / "file_store"
+        patcher = mock.patch.object(file_utils, "_CONTENT_STORE_DIR", str(self.store))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 每个用例使用新的工作目录，已确保存在的相对目录缓存不能沿用
+        dirs_patcher = mock.patch.object(file_utils, "_ensured_dirs", set())
+        dirs_patcher.start()
+        self.addCleanup(dirs_patcher.stop)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+
+    def _upload(self, name: str, content: bytes):
+        path = self.root / "uploads" / name
+        path.parent.mkdir(exist_ok=True)
+        _, digest = file_utils._store_upload(io.BytesIO(content), path, max_size=1024)
+        return path, digest
+
+    def test_duplicate_uploads_share_one_inode(self):
+        a, digest_a = self._upload("a.txt", b"same")
+        b, digest_b = self._upload("b.txt", b"same")
+        self.assertEqual(digest_a, digest_b)
+        self.assertTrue(os.path.samefile(a, b))
+        self.assertEqual(len(os.listdir(self.store)), 1)
+        self.assertEqual(os.stat(a).st_nlink, 3)
+
+    def test_store_entry_released_with_last_reference(self):
+        a, digest = self._upload("a.txt", b"same")
+        b, _ = self._upload("b.txt", b"same")
+
+        file_utils._move_to_temp(a, digest)
+        self.assertEqual(len(os.listdir(self.store)), 1)
+        self.assertEqual(os.stat(b).st_nlink, 2)
+
+        file_utils._move_to_temp(b, digest)
+        self.assertEqual(os.listdir(self.store), [])
+
+        trashed = list((self.root / "temp_deleted_files").iterdir())
+        self.assertEqual(len(trashed), 2)
+        for path in trashed:
+            self.assertEqual(path.read_bytes(), b"same")
+            self.assertEqual(os.stat(path).st_nlink, 1)
+
+    def test_concurrent_deletes_release_store_entry(self):
+        for _ in range(20):
+            a, digest = self._upload("a.txt", b"same")
+            b, _ = self._upload("b.txt", b"same")
+            barrier = threading.Barrier(2)
+
+            def delete(path):
+                barrier.wait()
+                file_utils._move_to_temp(path, digest)
+
+            threads = [threading.Thread(target=delete, args=(p,)) for p in (a, b)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(os.listdir(self.store), [])
+
+    def test_invalid_digest_skips_store(self):
+        a, _ = self._upload("a.txt", b"same")
+        file_utils._move_to_temp(a, "../uploads/a.txt")
+        self.assertFalse(a.exists())
+        self.assertEqual(len(os.listdir(self.store)), 1)
+
+    def test_store_is_outside_static(self):
+        from src.config.settings import settings
+        self.assertFalse(Path(settings.CONTENT_STORE_DIR).resolve().is_relative_to(Path("static").resolve()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from src.db.db import db_manager
+from src.repositories import file_repo, user_repo
+from src.repositories import _file_cache
+from src.schemas.file import FileType
+from src.schemas.user import UserCreate
+
+
+class FileCacheIsolationTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await db_manager.initialize()
+        _file_cache._cache.clear()
+        user = await user_repo.create_user(UserCreate(username=f"cache_{id(self)}", password="password1"))
+        self.user_id = user.id
+        await file_repo.create_user_file(
+            user_id=self.user_id,
+            session_id=None,
+            file_url=f"static/uploading/{self.user_id}/personal/a.txt",
+            file_type=FileType.DOCUMENT,
+            file_name="a.txt",
+            file_size=11,
+            mime_type="text/plain",
+            meta={"tags": ["x"]},
+        )
+
+    async def asyncTearDown(self):
+        await db_manager.close()
+
+    async def test_mutating_cached_stats_does_not_leak(self):
+        stats = await file_repo.get_user_file_stats(self.user_id)
+        stats["type_stats"]["document"] = 999
+
+        cached = await file_repo.get_user_file_stats(self.user_id)
+        self.assertEqual(cached["type_stats"], {"document": 1})
+        cached["type_stats"]["document"] = 999
+
+        self.assertEqual((await file_repo.get_user_file_stats(self.user_id))["type_stats"], {"document": 1})
+
+    async def test_mutating_cached_files_does_not_leak(self):
+        files = await file_repo.get_files_by_user_id(self.user_id)
+        files[0].file_name = "changed.txt"
+        files[0].meta["tags"].append("y")
+
+        cached = await file_repo.get_files_by_user_id(self.user_id)
+        self.assertEqual(cached[0].file_name, "a.txt")
+        self.assertEqual(cached[0].meta, {"tags": ["x"]})
+        cached[0].meta["tags"].append("z")
+        cached.clear()
+
+        again = await file_repo.get_files_by_user_id(self.user_id)
+        self.assertEqual(len(again), 1)
+        self.assertEqual(again[0].meta, {"tags": ["x"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from fastapi.testclient import TestClient
+
+from src.api.app import create_app
+
+_INVALID_PROFILE = {"routines": {"session_length_max": 1}}
+
+
+class PersonaProfileValidationTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = TestClient(create_app())
+        cls.client.__enter__()
+        r = cls.client.post("/user/register", json={"username": "persona_api", "password": "password1"})
+        assert r.status_code == 201, r.text
+        cls.headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.__exit__(None, None, None)
+
+    def test_create_with_out_of_range_profile_returns_422(self):
+        r = self.client.post(
+            "/user/persona", headers=self.headers, json={"name": "bad", "profile": _INVALID_PROFILE}
+        )
+        self.assertEqual(r.status_code, 422, r.text)
+
+    def test_update_with_out_of_range_profile_returns_422(self):
+        personas = self.client.get("/user/persona", headers=self.headers).json()
+        persona_id = personas[0]["id"]
+
+        r = self.client.put(f"/user/persona/{persona_id}", headers=self.headers, json={"profile": _INVALID_PROFILE})
+        self.assertEqual(r.status_code, 422, r.text)
+
+        r = self.client.put(
+            f"/user/persona/{persona_id}",
+            headers=self.headers,
+            json={"profile": {"routines": {"session_length_max": 90}}},
+        )
+        self.assertEqual(r.status_code, 200, r.text)
+        self.assertEqual(r.json()["profile"]["routines"]["session_length_max"], 90)
+
+
+if __name__ == "__main__":
+    unittest.main()
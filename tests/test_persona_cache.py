@@ -0,0 +1,36 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from src.agents import _persona_cache
+
+
+class PersonaCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        _persona_cache._cache.clear()
+
+    async def test_invalidate_during_load_does_not_cache_stale_text(self):
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_load(user_id, persona_id):
+            started.set()
+            await release.wait()
+            return "old"
+
+        with mock.patch.object(_persona_cache, "_load_persona_text", slow_load):
+            task = asyncio.create_task(_persona_cache.get_persona_text_cached("u1", None))
+            await started.wait()
+            _persona_cache.invalidate(user_id="u1")
+            release.set()
+            self.assertEqual(await task, "old")
+
+        self.assertNotIn(("u1", None), _persona_cache._cache)
+
+        with mock.patch.object(_persona_cache, "_load_persona_text", mock.AsyncMock(return_value="new")):
+            self.assertEqual(await _persona_cache.get_persona_text_cached("u1", None), "new")
+        self.assertEqual(_persona_cache._cache[("u1", None)][1], "new")
+
+
+if __name__ == "__main__":
+    unittest.main()